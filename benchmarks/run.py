@@ -0,0 +1,213 @@
+"""
+Benchmarks for the list2csv writing paths.
+
+Run from the repository root with::
+
+    python benchmarks/run.py
+
+Each case reports rows and bytes written per second and is compared against
+the baseline stored in ``benchmarks/baseline.json``. Use ``--save`` to
+replace the baseline after an intentional change, ``--check`` to exit with a
+non-zero status when any case regresses beyond ``--threshold``, and ``-k`` to
+run only the cases whose name contains the given text.
+
+Baselines are only comparable on the machine they were recorded on.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+from statistics import mean
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import list2csv  # noqa: E402
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+
+class Item:
+    def __init__(self, i, width):
+        self.i = i
+        self.name = 'item-{}'.format(i)
+        self.value = i * 0.25
+        self.flag = i % 3 == 0
+        self.values = [i + j * 0.5 for j in range(width)]
+        for j in range(40):
+            setattr(self, 'a{}'.format(j), i + j)
+
+
+def simple_strings(writer, columns):
+    for j in range(columns):
+        writer.add_column('A{}'.format(j), 'a{}'.format(j))
+
+
+def simple_callables(writer, columns):
+    for j in range(columns):
+        attribute = 'a{}'.format(j)
+        writer.add_column(
+            'A{}'.format(j), lambda item, a=attribute: getattr(item, a)
+        )
+
+
+def formatted(writer, columns):
+    for j in range(columns):
+        writer.add_column('A{}'.format(j), 'a{}'.format(j), '{:.2f}')
+
+
+def counters(writer, columns):
+    for j in range(columns):
+        writer.add_counter('C{}'.format(j), j, j + 1)
+
+
+def multi(width):
+    def configure(writer, columns):
+        writer.add_multi('V{}', 'values', width, '{}', {'values'})
+    return configure
+
+
+def wide_multi(width):
+    def configure(writer, columns):
+        writer.add_wide_multi('V{}', 'values', width, '{}', {'values'})
+    return configure
+
+
+def aggregators(writer, columns):
+    for j in range(columns):
+        writer.add_column('A{}'.format(j), 'a{}'.format(j), '{}', {j % 4})
+    for j in range(4):
+        writer.add_aggregator(j, 'Sum {}'.format(j), sum, '{}', {'outer'})
+    writer.add_aggregator('outer', 'Max', max)
+
+
+def mixed(writer, columns):
+    writer.add_counter('N')
+    writer.add_column('Name', 'name')
+    writer.add_column('Value', 'value', '{:.2f}', {'all'})
+    writer.add_column('Flag', lambda item: 'yes' if item.flag else 'no')
+    writer.add_multi('V{}', 'values', 10, '{:.1f}', {'all'})
+    writer.add_aggregator('all', 'Total', sum, '{:.2f}')
+
+
+# name, configure, number of columns, width of multi columns, number of rows
+CASES = [
+    ('simple-str-10', simple_strings, 10, 0, 20000),
+    ('simple-str-40', simple_strings, 40, 0, 5000),
+    ('simple-callable-10', simple_callables, 10, 0, 20000),
+    ('simple-callable-40', simple_callables, 40, 0, 5000),
+    ('formatted-10', formatted, 10, 0, 20000),
+    ('counter-10', counters, 10, 0, 20000),
+    ('multi-3', multi(3), 0, 3, 50000),
+    ('multi-100', multi(100), 0, 100, 2000),
+    ('multi-1000', multi(1000), 0, 1000, 200),
+    ('multi-10000', multi(10000), 0, 10000, 20),
+    ('wide-multi-100', wide_multi(100), 0, 100, 2000),
+    ('wide-multi-1000', wide_multi(1000), 0, 1000, 200),
+    ('wide-multi-10000', wide_multi(10000), 0, 10000, 20),
+    ('aggregators-16', aggregators, 16, 0, 10000),
+    ('mixed', mixed, 0, 10, 10000),
+]
+
+PATHS = ('write_row', 'write_all')
+
+
+def run_case(configure, columns, width, rows, path):
+    items = [Item(i, width) for i in range(rows)]
+    stream = io.StringIO()
+    writer = list2csv.Writer(stream)
+    configure(writer, columns)
+    writer.compile()
+    start = time.perf_counter()
+    if path == 'write_row':
+        for item in items:
+            writer.write_row(item)
+    else:
+        writer.write_all(items)
+    return time.perf_counter() - start, stream.tell()
+
+
+def measure(repeat, keyword):
+    results = {}
+    for name, configure, columns, width, rows in CASES:
+        for path in PATHS:
+            key = '{}/{}'.format(name, path)
+            if keyword and keyword not in key:
+                continue
+            best, size = min(
+                run_case(configure, columns, width, rows, path)
+                for _ in range(repeat)
+            )
+            results[key] = {
+                'rows_per_s': rows / best,
+                'bytes_per_s': size / best,
+            }
+    return results
+
+
+def report(results, baseline, threshold):
+    regressions = []
+    print('{:<32}{:>14}{:>12}{:>14}{:>10}'.format(
+        'case', 'rows/s', 'MB/s', 'baseline', 'change'
+    ))
+    for key, result in results.items():
+        rate = result['rows_per_s']
+        line = '{:<32}{:>14,.0f}{:>12.2f}'.format(
+            key, rate, result['bytes_per_s'] / 1e6
+        )
+        if key in baseline:
+            previous = baseline[key]['rows_per_s']
+            change = rate / previous - 1
+            line += '{:>14,.0f}{:>+10.1%}'.format(previous, change)
+            if change < -threshold:
+                line += '  REGRESSION'
+                regressions.append(key)
+        print(line)
+    changes = [
+        result['rows_per_s'] / baseline[key]['rows_per_s']
+        for key, result in results.items() if key in baseline
+    ]
+    if changes:
+        print('mean change: {:+.1%}'.format(mean(changes) - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each case, the best is reported')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--check', action='store_true',
+                        help='exit with status 1 if any case regresses')
+    parser.add_argument('-k', dest='keyword',
+                        help='only run cases whose name contains this')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    results = measure(args.repeat, args.keyword)
+    regressions = report(results, baseline, args.threshold)
+
+    if args.save:
+        with open(BASELINE, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': dict(baseline, **results),
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
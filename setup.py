@@ -27,4 +27,7 @@ setuptools.setup(
     package_data={'': ['*.pyi']},
     python_requires='>=3.6',
     install_requires=[],
+    extras_require={
+        'arrow': ['pyarrow'],
+    },
 )
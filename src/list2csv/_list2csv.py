@@ -1,8 +1,30 @@
 import abc
+import ast
+import asyncio
+import bz2
+import codecs
 import csv
-from collections import defaultdict
-from operator import attrgetter
-from typing import TypeVar, Union, Callable, Any, Iterable, Generic, TextIO
+import gzip
+import hashlib
+import inspect
+import io
+import keyword
+import lzma
+import math
+import multiprocessing
+import queue
+import threading
+import time
+import types
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, repeat
+from operator import attrgetter, itemgetter
+from string import Formatter
+from typing import (
+    TypeVar, Union, Callable, Any, Iterable, AsyncIterable, Generic, TextIO,
+    List, NamedTuple, BinaryIO, Mapping, Sequence, Optional,
+)
 
 _T = TypeVar('_T')
 _V = TypeVar('_V')
@@ -10,35 +32,168 @@ _V = TypeVar('_V')
 _eval_func = Union[Callable[[_T], Any], str]
 _multi_eval_func = Union[Callable[[_T], Iterable], str]
 _aggregate_func = Callable[[Iterable[_T]], Any]
+_reduce_func = Callable[[Any, Any], Any]
 
+_MISSING = object()
 
-class Writer(Generic[_T]):
-    def __init__(self, f: TextIO):
-        self._writer = csv.writer(f)
+
+def ref(*names: str, func: Callable[..., Any] = None) -> '_Ref':
+    """
+    Returns an evaluator of the named values, added with
+    :meth:`_ColumnSet.add_value`, for use in place of an evaluator of the
+    item.
+
+    The evaluator returns ``func`` called with the value of each name, in
+    order. Without ``func``, it returns the value of a single name, or a
+    tuple of the values of several names.
+    """
+    if not names:
+        raise ValueError('At least one value name must be given')
+    return _Ref(names, func)
+
+
+def register(name: str, func: Callable[..., Any] = None):
+    """
+    Registers ``func`` under ``name`` and returns an evaluator calling it,
+    which is pickled by name rather than by reference, so it can be used by
+    a :class:`Schema` sent to other processes, or recorded by
+    :meth:`Schema.fingerprint`. Processes receiving it must register the
+    same name, for example by importing the module registering it.
+
+    If ``func`` is not given, returns a decorator registering the decorated
+    function.
+    """
+    if func is None:
+        return lambda func: register(name, func)
+    if _REGISTRY.get(name, func) is not func:
+        raise ValueError(
+            'A different function is registered as {!r}'.format(name)
+        )
+    _REGISTRY[name] = func
+    return _Registered(name, func)
+
+
+def registered(name: str) -> '_Registered':
+    """
+    Returns the evaluator of the function registered under ``name``.
+    """
+    if name not in _REGISTRY:
+        raise ValueError('No function is registered as {!r}'.format(name))
+    return _Registered(name, _REGISTRY[name])
+
+
+_REGISTRY = {}
+
+
+def expr(source: str) -> '_Expression':
+    """
+    Returns an evaluator of ``source``, a Python expression whose free names
+    are attributes of the item, such as ``expr('marks[0] * 0.5')``.
+    Expressions may only use operators, comparisons, conditional
+    expressions, literals, attributes, subscripts and the builtins ``abs``,
+    ``all``, ``any``, ``bool``, ``float``, ``int``, ``len``, ``max``,
+    ``min``, ``round``, ``str`` and ``sum``, and are checked when this is
+    called. Like any Python expression, ``source`` may only span several
+    lines within brackets, with backslashes or in triple-quoted strings.
+
+    Unlike a lambda, the evaluator is compiled inline into the row function,
+    can be pickled and is recorded by :meth:`Schema.fingerprint`.
+    """
+    return _expression(source)
+
+
+class _ColumnSet(Generic[_T]):
+    def __init__(self):
         self._fields = []
         self._to_aggregate = defaultdict(list)
-        self._row_count = 0
+        self._values = {}
+        self._row_plan = None
+        self._variants = {}
+        # whether the columns are shared between a schema and its writers
+        self._shared = False
 
     def add_column(self,
                    header: str,
                    evaluator: _eval_func,
                    data_format: str = '{}',
-                   aggregate_ids: set = frozenset()):
+                   aggregate_ids: set = frozenset(),
+                   concurrent: bool = False,
+                   cache_key: _eval_func = None,
+                   cache_size: int = 1024,
+                   hidden: bool = False):
         """
         Adds a column of name ``header``.
 
         For each item of type ``T``, the value of ``evaluator(item)`` is
         formatted using ``data_format`` as a format string and used as the
-        column data. If ``evaluator`` is a string, it is interpreted as an
-        attribute name of the item.
+        column data. If ``evaluator`` is a string, it is always interpreted
+        as an attribute name of the item, even if it could be read as an
+        expression; an expression must be given with :func:`expr`.
 
         Any field with ids in ``aggregate_ids`` will be aggregated in the
         relevant aggregator column for each given id.
         See :meth:`add_aggregator` for more.
+
+        If ``concurrent`` is true, ``write_all`` evaluates this column for
+        the upcoming items in a pool of threads while rows are written. This
+        suits evaluators that spend their time blocked on I/O.
+
+        If ``cache_key`` is given, the values of ``evaluator`` are cached
+        under ``cache_key(item)``, or the attribute of that name if it is a
+        string, and reused for items with the same key. At most
+        ``cache_size`` values are kept, discarding the least recently used.
+        See :meth:`cache_report` for the effectiveness of the cache.
+
+        If ``hidden`` is true, the column is not written and is only
+        evaluated for the aggregator columns that aggregate it. A hidden
+        column that nothing aggregates is never evaluated.
         """
-        field = _Simple(header, evaluator, data_format)
-        self._fields.append(field)
-        self._add_to_aggregate(field, aggregate_ids)
+        evaluator = self._bind(evaluator)
+        if concurrent and isinstance(evaluator, _Reference):
+            raise ValueError(
+                'Columns of named values cannot be evaluated concurrently'
+            )
+        if cache_key is not None:
+            if isinstance(evaluator, _Reference):
+                raise ValueError('Columns of named values cannot be cached')
+            if cache_size < 1:
+                raise ValueError('cache_size must be at least 1')
+            evaluator = _LRUCache(
+                _Field.normalise_evaluator(evaluator),
+                _Field.normalise_evaluator(cache_key),
+                cache_size,
+            )
+        field = _Simple(header, evaluator, data_format, concurrent)
+        field.hidden = hidden
+        self._add_field(field, aggregate_ids)
+
+    def add_batch_column(self,
+                         header: str,
+                         batch_evaluator: Callable[[List[_T]], Sequence],
+                         batch_size: int = 256,
+                         data_format: str = '{}',
+                         aggregate_ids: set = frozenset()):
+        """
+        Adds a column as for :meth:`add_column`, but whose evaluator takes a
+        list of up to ``batch_size`` items and returns a sequence with the
+        value for each of them, in the same order.
+
+        ``write_all`` and columnar writes call ``batch_evaluator`` once for
+        each ``batch_size`` items, rather than once per item, which suits
+        lookups with a high cost per call. A batch never spans two chunks of
+        ``write_all``, so ``chunk_size`` should be a multiple of
+        ``batch_size``. Single rows are evaluated as batches of one item. If
+        ``batch_evaluator`` raises an exception, the items of that batch are
+        evaluated one at a time, so the rows before the failing item are
+        still written.
+
+        For an :class:`AsyncWriter`, ``batch_evaluator`` may be a coroutine
+        function, and the batches of a chunk are awaited at the same time.
+        """
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
+        field = _Batched(header, batch_evaluator, batch_size, data_format)
+        self._add_field(field, aggregate_ids)
 
     def add_aggregator(self,
                        aggregate_id: Any,
@@ -59,10 +214,9 @@ class Writer(Generic[_T]):
         """
         to_aggregate = self._to_aggregate[aggregate_id]
         field = _Aggregator(
-            header, aggregate_evaluator, data_format, to_aggregate
+            header, aggregate_evaluator, data_format, aggregate_id, to_aggregate
         )
-        self._fields.append(field)
-        self._add_to_aggregate(field, aggregate_ids)
+        self._add_field(field, aggregate_ids)
 
     def add_counter(self,
                     header: str,
@@ -76,15 +230,15 @@ class Writer(Generic[_T]):
         the given ``step`` value. The counter starts at ``start`` inclusive.
         """
         field = _Counter(header, start, step)
-        self._fields.append(field)
-        self._add_to_aggregate(field, aggregate_ids)
+        self._add_field(field, aggregate_ids)
 
     def add_multi(self,
                   header_template: str,
                   evaluator: _multi_eval_func,
                   num_items: int,
                   data_format: str = '{}',
-                  aggregate_ids: set = frozenset()):
+                  aggregate_ids: set = frozenset(),
+                  hidden: bool = False):
         """
         Adds several columns, each corresponding to a single value taken from
         an Iterable of length ``num_items``.
@@ -97,14 +251,866 @@ class Writer(Generic[_T]):
 
         If aggregate ids are given, the columns will be aggregated in the
         relevant aggregator columns for each given id.
+
+        Hidden columns are only evaluated for aggregators, as for
+        :meth:`add_column`.
         """
-        evaluator = _Field.normalise_evaluator(evaluator)
-        sequence_field = _Simple('', lambda item: tuple(evaluator(item)), '{}')
+        sequence_field = _Sequence(header_template, self._bind(evaluator))
         for i in range(1, num_items + 1):
             header = header_template.format(i)
             field = _Multi(header, sequence_field, i - 1, data_format)
-            self._fields.append(field)
-            self._add_to_aggregate(field, aggregate_ids)
+            field.hidden = hidden
+            self._add_field(field, aggregate_ids)
+
+    def add_wide_multi(self,
+                       header_template: str,
+                       evaluator: _multi_eval_func,
+                       num_items: int,
+                       data_format: str = '{}',
+                       aggregate_ids: set = frozenset(),
+                       hidden: bool = False):
+        """
+        Adds several columns as for :meth:`add_multi`, but as a single column
+        which writes all ``num_items`` values of the Iterable into the row at
+        once and formats them in one pass. This is much faster when there are
+        many values.
+
+        If aggregate ids are given, all the values will be aggregated in the
+        relevant aggregator columns for each given id.
+
+        Hidden columns are only evaluated for aggregators, as for
+        :meth:`add_column`.
+        """
+        field = _WideMulti(
+            header_template, self._bind(evaluator), num_items, data_format
+        )
+        field.hidden = hidden
+        self._add_field(field, aggregate_ids)
+
+    def add_value(self,
+                  name: str,
+                  evaluator: _eval_func,
+                  aggregate_ids: set = frozenset()):
+        """
+        Adds a named value, evaluated once per row as for :meth:`add_column`
+        but not written. Columns and other values can use it with an
+        evaluator returned by :func:`ref`, and it can be aggregated by
+        aggregator columns like any other column.
+
+        A value must be added before the columns that reference it.
+        """
+        if name in self._values:
+            raise ValueError('A value named {!r} already exists'.format(name))
+        field = _Value(name, self._bind(evaluator))
+        self._add_field(field, aggregate_ids)
+        self._values[name] = field
+
+    def add_type(self,
+                 item_type: type,
+                 headers: Mapping[str, str] = None,
+                 formats: Mapping[str, str] = None,
+                 widths: Mapping[str, int] = None,
+                 exclude: Iterable[str] = (),
+                 properties: bool = True):
+        """
+        Adds a column for each public field of ``item_type``, a dataclass,
+        NamedTuple or attrs class, in the order they are declared, followed
+        by a column for each of its public properties if ``properties`` is
+        true.
+
+        Columns are headed by the field name unless given in ``headers``,
+        and formatted with the format string given in ``formats``, if any,
+        both keyed by field name. A field annotated as a list, or given a
+        number of values in ``widths``, is added as a multi column with that
+        many values, headed by the header template in ``headers`` or by the
+        field name followed by the one-based index. Fields in ``exclude`` are
+        skipped.
+
+        The fields of a NamedTuple are read from the tuple by index.
+        """
+        headers = dict(headers or {})
+        formats = dict(formats or {})
+        widths = dict(widths or {})
+        exclude = set(exclude)
+        names, is_tuple = _type_fields(item_type)
+        if properties:
+            names += [
+                (name, None) for name in _type_properties(item_type)
+                if name not in dict(names)
+            ]
+        unknown = (
+            set(headers) | set(formats) | set(widths) | exclude
+        ) - {name for name, _ in names}
+        if unknown:
+            raise ValueError('{!r} has no fields {}'.format(
+                item_type, ', '.join(map(repr, sorted(unknown)))
+            ))
+        record = _Record(item_type) if is_tuple else None
+        for name, annotation in names:
+            if name in exclude:
+                continue
+            data_format = formats.get(name, '{}')
+            if name in widths or _is_list_type(annotation):
+                if name not in widths:
+                    raise ValueError(
+                        'The width of list field {!r} must be given in '
+                        'widths'.format(name)
+                    )
+                header = headers.get(name, name + ' {}')
+                self.add_multi(header, name, widths[name], data_format)
+            elif record is not None and name in item_type._fields:
+                index = item_type._fields.index(name)
+                header = headers.get(name, name)
+                field = _Member(header, record, index, name, data_format)
+                self._add_field(field, ())
+            else:
+                self.add_column(headers.get(name, name), name, data_format)
+
+    def compile(self):
+        """
+        Compiles the configured columns into a single function that builds
+        the data of a row from an item.
+
+        This is done implicitly by the first write after columns are added,
+        and must be done again if further columns are added afterwards.
+        """
+        self._row_plan = self._row_compiler().compile()
+
+    def cache_report(self) -> List['CacheStats']:
+        """
+        Returns the statistics of the cache of each column added with a
+        ``cache_key``, in the order the columns were added.
+
+        Rows built by worker processes are not counted.
+        """
+        return [
+            CacheStats(
+                field.header, cache.hits, cache.misses, cache.evictions,
+                len(cache),
+            )
+            for field in self._fields
+            for cache in [getattr(field, 'evaluator', None)]
+            if isinstance(cache, _LRUCache)
+        ]
+
+    def _headers(self, fields=None):
+        return [
+            header
+            for field in (self._fields if fields is None else fields)
+            if not field.hidden
+            for header in field.headers()
+        ]
+
+    def _row_compiler(self, fields=None, **options):
+        if fields is None:
+            fields = self._fields
+        return _RowCompiler(fields, **options)
+
+    def _variant(self, key, **options):
+        """
+        Returns a row function compiled with the given compiler options,
+        cached under ``key`` until the columns change.
+        """
+        if key not in self._variants:
+            self._variants[key] = self._row_compiler(**options).compile()
+        return self._variants[key]
+
+    def _batched_row_function(self):
+        """
+        Returns the row function taking the values of the batched fields as
+        prefetched values, and those fields.
+        """
+        batched = [field for field in _Plan(self._fields).order
+                   if field.batched]
+        if batched:
+            return self._variant('batched', prefetched=batched), batched
+        if self._row_plan is None:
+            self.compile()
+        return self._row_plan, batched
+
+    def _bind(self, evaluator):
+        if not isinstance(evaluator, _Ref):
+            return evaluator
+        fields = []
+        for name in evaluator.names:
+            if name not in self._values:
+                raise ValueError('No value named {!r}'.format(name))
+            fields.append(self._values[name])
+        return _Reference(fields, evaluator.func)
+
+    def _invalidate(self):
+        self._row_plan = None
+        self._variants = {}
+
+    def _add_field(self, field, aggregate_ids):
+        if self._shared:
+            raise ValueError(
+                'Columns cannot be added once a schema is used by writers'
+            )
+        self._fields.append(field)
+        self._add_to_aggregate(field, aggregate_ids)
+        self._invalidate()
+
+    def _add_to_aggregate(self, field, aggregate_ids):
+        for id_ in aggregate_ids:
+            self._to_aggregate[id_].append(field)
+
+
+class Schema(_ColumnSet[_T]):
+    """
+    A set of columns, added as to a :class:`Writer`, from which any number
+    of writers can be created with ``Writer(f, schema=schema)``. Writers
+    share the columns, including the caches of cached columns, and the
+    compiled row function of the schema, so are cheap to create. No columns
+    can be added to the schema or its writers once it is used.
+
+    A schema can be pickled if its evaluators can be, such as attribute
+    names, module level functions and functions given to :func:`register`.
+    """
+
+    def fingerprint(self) -> str:
+        """
+        Returns a hex digest identifying the columns of the schema, equal
+        for schemas with the same columns, formats and evaluators, in any
+        process. Functions are identified by their registered name, or
+        otherwise by their qualified name.
+
+        Raises ``ValueError`` if any evaluator cannot be identified by
+        name, such as a lambda, a nested function or a ``functools.partial``,
+        or if an aggregate id or other setting is not a plain value.
+        """
+        index = {}
+        descriptions = []
+
+        def describe(value):
+            if isinstance(value, _Field):
+                if value not in index:
+                    index[value] = len(index)
+                    state = sorted(
+                        (name, describe(attribute))
+                        for name, attribute in vars(value).items()
+                        if name != 'format_spec'
+                    )
+                    descriptions.append((type(value).__name__, state))
+                return 'field', index[value]
+            if isinstance(value, (list, tuple)):
+                return [describe(item) for item in value]
+            if isinstance(value, _Registered):
+                return 'registered', value.name
+            if isinstance(value, _Reference):
+                return 'reference', describe([value.fields, value.func])
+            if isinstance(value, _LRUCache):
+                return 'cache', describe(value.__getstate__())
+            if isinstance(value, _Expression):
+                return 'expression', value.canonical
+            if isinstance(value, attrgetter):
+                return 'attrgetter', value.__reduce__()[1]
+            if isinstance(value, (
+                types.FunctionType, types.BuiltinFunctionType, type
+            )) and '<' not in value.__qualname__ and isinstance(
+                getattr(value, '__self__', None),
+                (types.ModuleType, type, type(None))
+            ):
+                # module level functions and classes, found by name in any
+                # process, unlike lambdas, nested functions and builtin
+                # methods bound to an instance
+                return 'function', '{}.{}'.format(
+                    value.__module__, value.__qualname__
+                )
+            if value is None or isinstance(
+                value, (bool, int, float, complex, str, bytes)
+            ):
+                return repr(value)
+            raise ValueError(
+                'Cannot fingerprint {!r}: evaluators must be attribute '
+                'names, expressions, module level functions or registered '
+                'functions'.format(value)
+            )
+
+        describe(self._fields)
+        digest = hashlib.sha256(repr(descriptions).encode('utf-8'))
+        return digest.hexdigest()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_row_plan'] = None
+        state['_variants'] = {}
+        return state
+
+
+class Writer(_ColumnSet[_T]):
+    @classmethod
+    def from_type(cls,
+                  item_type: type,
+                  f: TextIO,
+                  headers: Mapping[str, str] = None,
+                  formats: Mapping[str, str] = None,
+                  widths: Mapping[str, int] = None,
+                  exclude: Iterable[str] = (),
+                  properties: bool = True,
+                  profile: bool = False) -> 'Writer':
+        """
+        Creates a writer of CSV data to ``f`` with the columns of
+        ``item_type`` added by :meth:`add_type`.
+        """
+        writer = cls(f, profile)
+        writer.add_type(
+            item_type, headers, formats, widths, exclude, properties
+        )
+        return writer
+
+    def __init__(self,
+                 f: TextIO,
+                 profile: bool = False,
+                 schema: Schema = None):
+        """
+        Creates a writer of CSV data to ``f``.
+
+        If ``profile`` is true, the time spent evaluating and formatting each
+        column is recorded. See :meth:`profile_report`.
+
+        If ``schema`` is given, the writer writes its columns, and further
+        columns cannot be added. Footers can still be added to the writer.
+        """
+        super().__init__()
+        self._schema = schema
+        if schema is not None:
+            schema._shared = True
+            self._fields = schema._fields
+            self._to_aggregate = schema._to_aggregate
+            self._values = schema._values
+            self._shared = True
+        self._writer = csv.writer(f)
+        self._row_count = 0
+        self._footers = {}
+        self._profile = {} if profile else None
+        self._output = None
+
+    @classmethod
+    def open(cls,
+             path: str,
+             compression: str = None,
+             compresslevel: int = None,
+             encoding: str = 'utf-8',
+             buffer_size: int = 1 << 20,
+             profile: bool = False,
+             schema: Schema = None) -> 'Writer':
+        """
+        Creates a writer of CSV data to a new file at ``path``, optionally
+        compressed with ``compression``: one of ``'gzip'``, ``'bz2'`` or
+        ``'xz'``. ``compresslevel`` is passed to the compressor, or is the
+        preset for ``'xz'``, and defaults to 6 for ``'gzip'`` and to the
+        module default otherwise.
+
+        Rows are collected in memory and encoded and compressed in blocks of
+        about ``buffer_size`` characters. The writer must be closed, or used
+        as a context manager, to write the last block and close the file.
+        """
+        if compression not in _OPENERS:
+            raise ValueError('Unknown compression {!r}'.format(compression))
+        if buffer_size < 1:
+            raise ValueError('buffer_size must be at least 1')
+        raw = _OPENERS[compression](path, compresslevel)
+        buffer = io.StringIO(newline='')
+        writer = cls(buffer, profile, schema)
+        writer._output = _EncodedOutput(buffer, raw, encoding, buffer_size)
+        return writer
+
+    def close(self):
+        """
+        Writes any buffered data and closes the file of a writer created
+        with :meth:`open`. This has no effect on other writers.
+        """
+        if self._output is not None:
+            self._output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def compile(self):
+        if self._schema is not None and not self._footers \
+                and self._profile is None:
+            # the row function has no state of its own, so is shared with
+            # every other such writer of the schema
+            if self._schema._row_plan is None:
+                self._schema.compile()
+            self._row_plan = self._schema._row_plan
+        else:
+            super().compile()
+
+    def add_footer(self,
+                   header: str,
+                   accumulator: Union[str, _reduce_func] = 'sum',
+                   data_format: str = '{}',
+                   initial: Any = _MISSING):
+        """
+        Adds a footer value to the column named ``header``, accumulated from
+        the values of that column as rows are written. See
+        :meth:`write_footer`.
+
+        ``accumulator`` is one of ``'sum'``, ``'fsum'`` (an exact floating
+        point sum), ``'count'``, ``'mean'``, ``'min'`` or ``'max'``, or a
+        function ``reducer(total, value)`` returning the new total, starting
+        from ``initial`` if given and otherwise from the first value.
+
+        Values are accumulated before formatting and the footer value is
+        formatted using ``data_format``.
+        """
+        field = self._find_field(header)
+        if field.spliced:
+            raise ValueError(
+                'Footers cannot be added to wide multi columns'
+            )
+        if field in self._footers:
+            raise ValueError(
+                'Column {!r} already has a footer'.format(header)
+            )
+        if isinstance(accumulator, str):
+            if accumulator not in _ACCUMULATORS:
+                raise ValueError(
+                    'Unknown accumulator {!r}'.format(accumulator)
+                )
+            accumulator = _ACCUMULATORS[accumulator]()
+        else:
+            accumulator = _Reduce(accumulator, initial)
+        self._footers[field] = (accumulator, data_format)
+        self._invalidate()
+
+    def write_footer(self, headers: Sequence[str] = None):
+        """
+        Writes the footer row, holding the footer value of each column with
+        a footer accumulated over all rows written so far.
+
+        Columns without a footer, and footers other than ``'count'`` of
+        columns with no values, are left empty. If ``headers`` is given,
+        only those columns are written, as for :meth:`write_header`.
+        """
+        row = []
+        for field in self._selected(headers):
+            if field.hidden:
+                continue
+            value = None
+            if field in self._footers:
+                accumulator, data_format = self._footers[field]
+                value = accumulator.result()
+            if field.spliced:
+                row.extend([''] * len(field.headers()))
+            else:
+                row.append('' if value is None else data_format.format(value))
+        self._writer.writerow(row)
+
+    def write_header(self, headers: Sequence[str] = None):
+        """
+        Writes the header row.
+
+        This can be called at any time after adding columns.
+
+        If ``headers`` is given, only the columns with those headers are
+        written, in that order, by this and any other write given the same
+        ``headers``. Columns that are not written are not evaluated unless
+        a written aggregator column aggregates them, and footers only
+        accumulate the rows in which their column is evaluated. Any header
+        of a wide multi column selects all of its columns.
+        """
+        self._writer.writerow(self._headers(self._selected(headers)))
+
+    def write_row(self, item: _T, headers: Sequence[str] = None):
+        """
+        Writes a row of data.
+
+        The given ``item`` will be used to generate the data for each column.
+        If ``headers`` is given, only those columns are written, as for
+        :meth:`write_header`.
+        """
+        if headers is None:
+            if self._row_plan is None:
+                self.compile()
+            row = self._row_plan
+        else:
+            row = self._row_function(headers)
+        self._writer.writerow(row(item, self._row_count))
+        self._row_count += 1
+        if self._output is not None:
+            self._output.drain()
+
+    def write_all(self,
+                  items: Iterable[_T],
+                  chunk_size: int = None,
+                  workers: int = None,
+                  threads: int = None,
+                  prefetch: int = 0,
+                  headers: Sequence[str] = None,
+                  mp_context: multiprocessing.context.BaseContext = None):
+        """
+        Writes all the rows of data. This is equivalent to making repeated
+        calls to ``write_row`` with each item .
+
+        Rows are built for ``chunk_size`` items at a time, by default 1024,
+        and each chunk is written to the stream in a single call.
+
+        If ``workers`` is given, chunks are built in a pool of that many
+        processes, started with ``mp_context`` or by default the default
+        ``multiprocessing`` context, and written in their original order.
+        Items must be picklable, and so must evaluators unless processes
+        are started with the ``'fork'`` method, so lambdas and closures need
+        ``mp_context=multiprocessing.get_context('fork')`` where forking is
+        available.
+
+        Columns added with ``concurrent=True`` are evaluated in a pool of
+        ``threads`` threads, by default as many as
+        ``concurrent.futures.ThreadPoolExecutor`` uses, for the next chunk
+        of items while the current chunk is written.
+
+        If ``prefetch`` is positive, items are read from ``items`` on a
+        background thread, up to that many chunks ahead of the chunk being
+        written. This overlaps a slow source, such as a database cursor,
+        with building and writing rows. An exception raised by the source is
+        raised from ``write_all`` once the chunks before it are written. If
+        building or writing a row fails, the exception is raised without
+        waiting for the source, and the thread stops after the item it is
+        reading.
+
+        If ``headers`` is given, only those columns are written, as for
+        :meth:`write_header`.
+
+        If ``items`` is a pandas DataFrame, it is written with
+        :meth:`write_frame`, and if it is an Arrow Table, RecordBatch or
+        RecordBatchReader, it is written with :meth:`write_batches`, with
+        their default ``chunk_size`` unless one is given. ``workers``,
+        ``threads``, ``prefetch`` and ``mp_context`` cannot be used with
+        these.
+        """
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        if _is_data_frame(items) or _is_arrow_data(items):
+            if workers is not None or threads is not None or prefetch \
+                    or mp_context is not None:
+                raise ValueError(
+                    'workers, threads, prefetch and mp_context cannot be used'
+                    ' with a DataFrame or Arrow data'
+                )
+            options = {'headers': headers}
+            if chunk_size is not None:
+                options['chunk_size'] = chunk_size
+            if _is_data_frame(items):
+                self.write_frame(items, **options)
+            else:
+                self.write_batches(_arrow_batches(items), **options)
+            return
+        if chunk_size is None:
+            chunk_size = 1024
+        if prefetch < 0:
+            raise ValueError('prefetch cannot be negative')
+        if prefetch:
+            chunks = _prefetched_chunks(items, chunk_size, prefetch)
+        else:
+            chunks = _chunked(items, chunk_size)
+        try:
+            self._write_chunks(chunks, workers, threads, headers, mp_context)
+        finally:
+            # stops the producer thread if writing failed part way
+            chunks.close()
+
+    def _write_chunks(self, chunks, workers, threads, headers, mp_context):
+        fields = self._selected(headers)
+        if workers is not None:
+            self._write_all_parallel(chunks, workers, fields, mp_context)
+            return
+        live = _Plan(fields).order
+        concurrent = [field for field in live if field.concurrent]
+        batched = [field for field in live if field.batched]
+        row = self._row_function(headers, concurrent + batched)
+        if concurrent:
+            self._write_all_concurrent(chunks, threads, row, concurrent, batched)
+            return
+        for chunk in chunks:
+            rows = []
+            try:
+                rows.extend(_chunk_rows(row, chunk, self._row_count, batched))
+            finally:
+                # rows built before a failing item are still written, as
+                # they would have been by write_row
+                self._write_rows(rows)
+
+    def _write_all_concurrent(self, chunks, threads, row, concurrent, batched):
+        pending = deque()
+        with ThreadPoolExecutor(threads) as pool:
+            try:
+                for chunk in chunks:
+                    futures = [
+                        [pool.submit(field.evaluator, item)
+                         for field in concurrent]
+                        for item in chunk
+                    ]
+                    pending.append((chunk, futures))
+                    # one chunk is evaluated ahead of the chunk being written
+                    if len(pending) > 1:
+                        self._write_prefetched(
+                            row, *pending.popleft(), batched
+                        )
+                while pending:
+                    self._write_prefetched(row, *pending.popleft(), batched)
+            finally:
+                for _, futures in pending:
+                    for item_futures in futures:
+                        for future in item_futures:
+                            future.cancel()
+
+    def _write_prefetched(self, row, chunk, futures, batched):
+        start = self._row_count
+        rows = []
+        if batched:
+            batch_values = zip(*(field.resolve(chunk) for field in batched))
+        else:
+            batch_values = repeat(())
+        try:
+            for i, (item, item_futures, values) in enumerate(
+                zip(chunk, futures, batch_values)
+            ):
+                values = [
+                    *(future.result() for future in item_futures), *values
+                ]
+                rows.append(row(item, start + i, values))
+        finally:
+            self._write_rows(rows)
+
+    def write_columns(self,
+                      columns: Mapping[str, Sequence],
+                      chunk_size: int = 16384,
+                      headers: Sequence[str] = None):
+        """
+        Writes rows of data given as columns rather than as items, such as
+        NumPy arrays or lists of equal length. This writes the same data as
+        ``write_all`` would with items having each column as an attribute.
+
+        Columns added with an attribute name as the evaluator use the column
+        of that name and multi columns expect it to hold a sequence per row,
+        such as a two dimensional array. Other evaluators are called with
+        an item for each row built from the columns.
+
+        Data is evaluated and formatted a column at a time for
+        ``chunk_size`` rows at once. Arrays of numbers and strings are
+        converted to Python values first with ``tolist``; the values of other
+        columns are used as they are.
+
+        If ``headers`` is given, only those columns are written, as for
+        :meth:`write_header`.
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        lengths = {len(column) for column in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError('Columns must all have the same length')
+        fields = self._selected(headers)
+        plan = _Plan(fields)
+        size = lengths.pop() if lengths else 0
+        for start in range(0, size, chunk_size):
+            stop = min(start + chunk_size, size)
+            source = _MappingSource(columns, start, stop)
+            self._write_batch(plan, fields, source)
+
+    def write_frame(self,
+                    frame: Any,
+                    chunk_size: int = 16384,
+                    headers: Sequence[str] = None):
+        """
+        Writes a row of data for each row of a pandas DataFrame, as
+        :meth:`write_columns` does for a mapping of column names to columns.
+
+        Evaluators that are not the name of a column of the DataFrame are
+        called with an item for each row, built from the columns named by
+        valid attribute names.
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        fields = self._selected(headers)
+        plan = _Plan(fields)
+        for start in range(0, len(frame), chunk_size):
+            stop = min(start + chunk_size, len(frame))
+            self._write_batch(plan, fields, _FrameSource(frame, start, stop))
+
+    def write_batches(self,
+                      batches: Iterable[Any],
+                      chunk_size: int = 16384,
+                      headers: Sequence[str] = None):
+        """
+        Writes a row of data for each row of an iterable of Arrow record
+        batches, as :meth:`write_columns` does for a mapping of column names
+        to columns. Only one batch is held in memory at a time, and batches
+        are written ``chunk_size`` rows at a time.
+
+        Evaluators that are not the name of a column of the batch are called
+        with an item for each row, built from the columns named by valid
+        attribute names.
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        fields = self._selected(headers)
+        plan = _Plan(fields)
+        for batch in batches:
+            for start in range(0, batch.num_rows, chunk_size):
+                chunk = batch.slice(start, chunk_size)
+                self._write_batch(plan, fields, _ArrowSource(chunk))
+
+    def _write_batch(self, plan, fields, source):
+        batch = _ColumnBatch(source, self._row_count)
+        shared = {}
+        for field in plan.order:
+            key = field.share_key()
+            if key in shared:
+                values = shared[key]
+            else:
+                values = field._evaluate_column(batch)
+                if key is not None:
+                    shared[key] = values
+            batch.values[field] = values
+        cells = []
+        for field in fields:
+            if not field.hidden:
+                cells.extend(field._format_column(batch.values[field]))
+        # footers only accumulate once the whole batch has been built
+        for field in plan.order:
+            if field in self._footers:
+                add = self._footers[field][0].add
+                for value in batch.values[field]:
+                    add(value)
+        self._write_rows(list(zip(*cells)) or [()] * source.size)
+
+    def _write_all_parallel(self, chunks, workers, fields, context):
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        if self._footers:
+            raise ValueError('Footers cannot be accumulated by workers')
+        if self._profile is not None:
+            raise ValueError('Writers with profile=True cannot use workers')
+        if context is None:
+            context = multiprocessing.get_context()
+        # at most two chunks per worker are in flight or waiting to be
+        # written, which bounds memory regardless of the number of items
+        max_pending = 2 * workers
+        pending = deque()
+        next_row = self._row_count
+        with context.Pool(workers, _init_worker, (fields,)) as pool:
+            for chunk in chunks:
+                pending.append(
+                    pool.apply_async(_build_rows, (chunk, next_row))
+                )
+                next_row += len(chunk)
+                if len(pending) >= max_pending:
+                    self._write_built(pending.popleft().get())
+            while pending:
+                self._write_built(pending.popleft().get())
+
+    def _write_built(self, result):
+        rows, error = result
+        # rows built before a failing item are still written, as they would
+        # have been by write_row
+        self._write_rows(rows)
+        if error is not None:
+            raise error
+
+    def profile_report(self) -> List['ColumnProfile']:
+        """
+        Returns the profile of each column, in the order the columns are
+        evaluated, if the writer was created with ``profile=True``.
+
+        The shared sequence evaluated for the columns of a multi column is
+        reported under its header template, and the time of an aggregator
+        column excludes the time taken to evaluate the columns it aggregates.
+        """
+        if self._profile is None:
+            raise ValueError('Writer was not created with profile=True')
+        return [
+            ColumnProfile(
+                stats.header, stats.calls, stats.eval_time,
+                stats.format_time, stats.output_bytes,
+            )
+            for stats in self._profile.values()
+        ]
+
+    def _write_rows(self, rows):
+        self._writer.writerows(rows)
+        self._row_count += len(rows)
+        if self._output is not None:
+            self._output.drain()
+
+    def _find_field(self, header):
+        fields = [
+            field for field in self._fields
+            if not field.hidden and header in field.headers()
+        ]
+        if not fields:
+            raise ValueError('No column named {!r}'.format(header))
+        if len(fields) > 1:
+            raise ValueError('Several columns are named {!r}'.format(header))
+        return fields[0]
+
+    def _selected(self, headers):
+        """
+        Returns the fields written for the given headers, or all the fields
+        if ``headers`` is ``None``.
+        """
+        if headers is None:
+            return self._fields
+        key = 'headers', tuple(headers)
+        if key not in self._variants:
+            fields = dict.fromkeys(map(self._find_field, headers))
+            self._variants[key] = list(fields)
+        return self._variants[key]
+
+    def _row_function(self, headers=None, prefetched=()):
+        """
+        Returns the row function writing the given headers, taking the
+        values of any ``prefetched`` fields as an extra argument.
+        """
+        if headers is None and not prefetched:
+            if self._row_plan is None:
+                self.compile()
+            return self._row_plan
+        if headers is not None:
+            headers = tuple(headers)
+        key = 'row', headers, tuple(prefetched)
+        return self._variant(
+            key, fields=self._selected(headers), prefetched=prefetched
+        )
+
+    def _row_compiler(self, fields=None, **options):
+        observers = {
+            field: accumulator.add
+            for field, (accumulator, _) in self._footers.items()
+        }
+        profiler = None
+        if self._profile is not None:
+            profiler = self._column_stats
+        if fields is None:
+            fields = self._fields
+        return _RowCompiler(
+            fields, observers=observers, profiler=profiler, **options
+        )
+
+    def _column_stats(self, field):
+        if field not in self._profile:
+            self._profile[field] = _ColumnStats(field.header)
+        return self._profile[field]
+
+
+class AsyncWriter(_ColumnSet[_T]):
+    def __init__(self, f: TextIO, concurrency: int = 16):
+        """
+        Creates a writer whose evaluators may be coroutine functions.
+
+        Rows are still written in order, but up to ``concurrency`` rows are
+        evaluated at the same time.
+        """
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+        super().__init__()
+        self._writer = csv.writer(f)
+        self._concurrency = concurrency
+        self._row_count = 0
 
     def write_header(self):
         """
@@ -112,8 +1118,132 @@ class Writer(Generic[_T]):
 
         This can be called at any time after adding columns.
         """
-        headers = (f.header for f in self._fields)
-        self._writer.writerow(headers)
+        self._writer.writerow(self._headers())
+
+    async def write_row(self, item: _T):
+        """
+        Writes a row of data.
+
+        The given ``item`` will be used to generate the data for each column.
+        """
+        if self._row_plan is None:
+            self.compile()
+        self._writer.writerow(await self._row_plan(item, self._row_count))
+        self._row_count += 1
+
+    async def write_all(self,
+                        items: Union[Iterable[_T], AsyncIterable[_T]],
+                        chunk_size: int = 1024):
+        """
+        Writes all the rows of data from an iterable or asynchronous
+        iterable.
+
+        Rows are evaluated concurrently for ``chunk_size`` items at a time and
+        each chunk is written to the stream in a single call, in the order
+        the items were given. An exception raised for an item is raised once
+        the rows of the items before it are written.
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        row, batched = self._batched_row_function()
+        async for chunk in _async_chunked(items, chunk_size):
+            rows, error = await self._build_rows(chunk, row, batched)
+            # rows before a failing item are still written, as they would
+            # have been by write_row
+            self._writer.writerows(rows)
+            self._row_count += len(rows)
+            if error is not None:
+                raise error
+
+    async def _build_rows(self, chunk, row, batched):
+        """
+        Returns the rows of the items of ``chunk`` before the first that
+        failed, and the exception it raised, if any.
+        """
+        start = self._row_count
+        rows = [None] * len(chunk)
+        # the index of the first failing item and its exception
+        failure = [len(chunk), None]
+        if batched:
+            columns = []
+            for values, error in await asyncio.gather(
+                    *(field.resolve_async(chunk) for field in batched)):
+                columns.append(values)
+                if error is not None and len(values) < failure[0]:
+                    failure[:] = len(values), error
+            prefetched = list(zip(*columns))
+        else:
+            prefetched = None
+        indices = iter(range(failure[0]))
+
+        async def build():
+            for i in indices:
+                if i >= failure[0]:
+                    return
+                try:
+                    if prefetched is None:
+                        rows[i] = await row(chunk[i], start + i)
+                    else:
+                        rows[i] = await row(chunk[i], start + i, prefetched[i])
+                except Exception as e:
+                    if i < failure[0]:
+                        failure[:] = i, e
+                    return
+
+        builders = [
+            asyncio.ensure_future(build())
+            for _ in range(min(self._concurrency, len(chunk)))
+        ]
+        try:
+            await asyncio.gather(*builders)
+        except BaseException:
+            for builder in builders:
+                builder.cancel()
+            raise
+        return rows[:failure[0]], failure[1]
+
+    def _row_compiler(self, fields=None, **options):
+        if fields is None:
+            fields = self._fields
+        return _RowCompiler(fields, asynchronous=True, **options)
+
+
+class ArrowWriter(_ColumnSet[_T]):
+    def __init__(self,
+                 sink: Union[str, BinaryIO],
+                 file_format: str = 'parquet',
+                 row_group_size: int = 65536,
+                 types: Mapping[str, Any] = None):
+        """
+        Creates a writer of Parquet (``file_format='parquet'``) or Arrow IPC
+        (``file_format='ipc'``) data to ``sink``, a path or binary stream.
+        This requires ``pyarrow``.
+
+        Columns are configured as for a :class:`Writer`, with each header
+        naming a column of the output. Values are written unformatted, as
+        the ``pyarrow`` type given for their header in ``types``. The types
+        of the other columns are inferred from the first batch of rows and
+        fixed for the file, so a column that is empty or null in the first
+        batch, or holds integers before later floats, needs its type given.
+
+        Rows are written in batches, and Parquet row groups, of
+        ``row_group_size`` rows. :meth:`close` must be called after the last
+        row to write any remaining rows and finish the file.
+        """
+        if file_format not in ('parquet', 'ipc'):
+            raise ValueError('Unknown file format {!r}'.format(file_format))
+        if row_group_size < 1:
+            raise ValueError('row_group_size must be at least 1')
+        super().__init__()
+        self._pyarrow = _import_pyarrow()
+        self._sink = sink
+        self._file_format = file_format
+        self._row_group_size = row_group_size
+        self._types = dict(types or {})
+        self._rows = []
+        self._row_count = 0
+        self._schema = None
+        self._writer = None
 
     def write_row(self, item: _T):
         """
@@ -121,46 +1251,220 @@ class Writer(Generic[_T]):
 
         The given ``item`` will be used to generate the data for each column.
         """
-        row = []
-        for field in self._fields:
-            value = field.eval(item, self._row_count)
-            value = field.format(value)
-            row.append(value)
-        self._writer.writerow(row)
+        if self._row_plan is None:
+            self.compile()
+        self._rows.append(self._row_plan(item, self._row_count))
         self._row_count += 1
+        if len(self._rows) >= self._row_group_size:
+            self._write_batch()
 
-    def write_all(self, items: Iterable[_T]):
+    def write_all(self, items: Iterable[_T], chunk_size: int = 1024):
         """
         Writes all the rows of data. This is equivalent to making repeated
-        calls to ``write_row`` with each item .
+        calls to ``write_row`` with each item, except that batch columns
+        are evaluated for ``chunk_size`` items at a time.
         """
-        for item in items:
-            self.write_row(item)
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        row, batched = self._batched_row_function()
+        for chunk in _chunked(items, chunk_size):
+            for values in _chunk_rows(row, chunk, self._row_count, batched):
+                self._rows.append(values)
+                self._row_count += 1
+                if len(self._rows) >= self._row_group_size:
+                    self._write_batch()
+
+    def close(self):
+        """
+        Writes any remaining rows and finishes the file.
+        """
+        if self._rows or self._writer is None:
+            self._write_batch()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _row_compiler(self, fields=None, **options):
+        if fields is None:
+            fields = self._fields
+        return _RowCompiler(fields, formatted=False, **options)
+
+    def _write_batch(self):
+        pa = self._pyarrow
+        headers = self._headers()
+        columns = list(zip(*self._rows)) or [()] * len(headers)
+        if self._schema is None:
+            unknown = set(self._types).difference(headers)
+            if unknown:
+                raise ValueError('Types given for unknown headers {}'.format(
+                    ', '.join(map(repr, sorted(unknown)))
+                ))
+            arrays = [
+                pa.array(column, type=self._types.get(header))
+                for column, header in zip(columns, headers)
+            ]
+            batch = pa.RecordBatch.from_arrays(arrays, names=headers)
+            self._schema = batch.schema
+            self._writer = self._open(self._schema)
+        else:
+            arrays = []
+            for column, field in zip(columns, self._schema):
+                try:
+                    arrays.append(pa.array(column, type=field.type))
+                except (pa.ArrowException, TypeError, ValueError) as e:
+                    raise ValueError(
+                        'Values of column {!r} do not fit its type {}, '
+                        'inferred from the first batch of rows; give its '
+                        'type in types'.format(field.name, field.type)
+                    ) from e
+            batch = pa.RecordBatch.from_arrays(arrays, schema=self._schema)
+        self._writer.write_batch(batch)
+        self._rows = []
+
+    def _open(self, schema):
+        if self._file_format == 'ipc':
+            return self._pyarrow.ipc.new_file(self._sink, schema)
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(self._sink, schema)
+
+
+class _EncodedOutput:
+    """
+    Moves the text written to ``buffer`` to the binary stream ``raw`` in
+    encoded blocks of at least ``buffer_size`` characters, so that encoding
+    and compression work on large blocks rather than on each row.
+    """
+
+    def __init__(self, buffer, raw, encoding, buffer_size):
+        self.buffer = buffer
+        self.raw = raw
+        # an incremental encoder writes a byte order mark only at the start
+        # of the file, not at the start of each block
+        self.encoder = codecs.getincrementalencoder(encoding)()
+        self.buffer_size = buffer_size
+
+    def drain(self):
+        if self.buffer.tell() >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.raw.write(self.encoder.encode(self.buffer.getvalue()))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def close(self):
+        if not self.raw.closed:
+            self.flush()
+            self.raw.write(self.encoder.encode('', final=True))
+            self.raw.close()
+
+
+def _open_plain(path, compresslevel):
+    if compresslevel is not None:
+        raise ValueError('compresslevel requires compression')
+    return open(path, 'wb')
 
-    def _add_to_aggregate(self, field, aggregate_ids):
-        for id_ in aggregate_ids:
-            self._to_aggregate[id_].append(field)
+
+def _open_gzip(path, compresslevel):
+    # zlib's default level compresses CSV data almost as well as gzip's
+    # default of 9, in two thirds of the time
+    if compresslevel is None:
+        compresslevel = 6
+    return gzip.open(path, 'wb', compresslevel)
+
+
+def _open_bz2(path, compresslevel):
+    if compresslevel is None:
+        return bz2.open(path, 'wb')
+    return bz2.open(path, 'wb', compresslevel)
+
+
+def _open_xz(path, compresslevel):
+    return lzma.open(path, 'wb', preset=compresslevel)
+
+
+_OPENERS = {
+    None: _open_plain,
+    'gzip': _open_gzip,
+    'bz2': _open_bz2,
+    'xz': _open_xz,
+}
 
 
 class _Field(abc.ABC, Generic[_T, _V]):
+    # whether the field writes several cells, spliced into the row from its
+    # value, rather than a single one
+    spliced = False
+    # whether write_all evaluates the field ahead of time in a thread pool
+    concurrent = False
+    # whether the field is evaluated for a list of items at a time
+    batched = False
+    # whether the field is evaluated for other fields but not written
+    hidden = False
+
     def __init__(self, header, data_format):
         self.header = header
         self.data_format = data_format
-        self.last_row = -1
-        self.last_value = None
+        self.format_spec = _parse_format(data_format)
 
-    def eval(self, item: _T, row_number: int) -> _V:
-        if row_number != self.last_row:
-            self.last_row = row_number
-            self.last_value = self._eval(item, row_number)
-        return self.last_value
+    def headers(self) -> List[str]:
+        return [self.header]
 
-    def format(self, value: _V) -> str:
-        return self.data_format.format(value)
+    def dependencies(self) -> List['_Field']:
+        """
+        Returns the fields whose values are needed to evaluate this field.
+        """
+        return []
+
+    def share_key(self):
+        """
+        Returns a key equal to that of any other field which always has the
+        same value for an item, so the value is only evaluated once per row,
+        or ``None`` if the value cannot be shared.
+        """
+        return None
 
     @abc.abstractmethod
-    def _eval(self, item: _T, row_number: int) -> _V:
-        ...
+    def _evaluate_column(self, batch: '_ColumnBatch') -> List[_V]:
+        """
+        Returns the values of this field for every row of the batch.
+        """
+
+    def _format_column(self, values: List[_V]) -> List[List[str]]:
+        """
+        Returns the cells of each column written by this field, given its
+        values for every row of a batch.
+        """
+        if self.format_spec is None:
+            return [list(map(self.data_format.format, values))]
+        conversion, spec = self.format_spec
+        if conversion is not None:
+            values = map(_CONVERSIONS[conversion], values)
+        return [list(map(format, values, repeat(spec)))]
+
+    @abc.abstractmethod
+    def _compile(self, compiler: '_RowCompiler') -> str:
+        """
+        Returns the source of an expression evaluating this field in the
+        compiled row function.
+        """
+
+    def _compile_format(self, compiler: '_RowCompiler', value: str) -> str:
+        if self.format_spec is None:
+            formatter = compiler.constant(self.data_format.format)
+            return '{}({})'.format(formatter, value)
+        conversion, spec = self.format_spec
+        if conversion is not None:
+            value = '{}({})'.format(_CONVERSIONS[conversion].__name__, value)
+            if not spec:
+                return value
+        if spec:
+            return 'format({}, {!r})'.format(value, spec)
+        return 'format({})'.format(value)
 
     @staticmethod
     def normalise_evaluator(evaluator):
@@ -170,23 +1474,205 @@ class _Field(abc.ABC, Generic[_T, _V]):
 
 
 class _Simple(_Field):
-    def __init__(self, header, evaluator, data_format):
+    def __init__(self, header, evaluator, data_format, concurrent=False):
         super().__init__(header, data_format)
+        self.attribute = evaluator if isinstance(evaluator, str) else None
         self.evaluator = _Field.normalise_evaluator(evaluator)
+        self.concurrent = concurrent
+
+    def dependencies(self):
+        return _evaluator_dependencies(self.evaluator)
+
+    def share_key(self):
+        return _evaluator_key(self.evaluator, self.attribute)
+
+    def _compile(self, compiler):
+        return compiler.call(self.evaluator, attribute=self.attribute)
+
+    def _evaluate_column(self, batch):
+        return batch.evaluate(self.evaluator, self.attribute)
+
+
+class _Record(_Field):
+    """
+    The tuple of a NamedTuple item, whose members are read from it by index
+    rather than by attribute.
+    """
+
+    hidden = True
 
-    def _eval(self, item: _T, row_number: int):
-        return self.evaluator(item)
+    def __init__(self, item_type):
+        super().__init__(item_type.__name__, '{}')
+
+    def _compile(self, compiler):
+        return 'item'
+
+    def _evaluate_column(self, batch):
+        # members read their own columns in columnar writes
+        return [None] * batch.size
+
+
+class _Member(_Simple):
+    def __init__(self, header, record, index, name, data_format):
+        super().__init__(header, name, data_format)
+        self.record = record
+        self.index = index
+
+    def dependencies(self):
+        return [self.record]
+
+    def _compile(self, compiler):
+        return '{}[{}]'.format(compiler.value(self.record), self.index)
+
+
+class _Value(_Simple):
+    hidden = True
+
+    def __init__(self, name, evaluator):
+        super().__init__(name, evaluator, '{}')
+
+
+class _Sequence(_Simple):
+    def __init__(self, header, evaluator):
+        super().__init__(header, evaluator, '{}')
+
+    def share_key(self):
+        return 'tuple', super().share_key()
+
+    def _evaluate_column(self, batch):
+        return list(map(tuple, super()._evaluate_column(batch)))
+
+    def _compile(self, compiler):
+        return 'tuple({})'.format(super()._compile(compiler))
+
+
+class _Batched(_Field):
+    batched = True
+
+    def __init__(self, header, evaluator, batch_size, data_format):
+        super().__init__(header, data_format)
+        self.evaluator = evaluator
+        self.batch_size = batch_size
+
+    def resolve(self, items):
+        """
+        Yields the value for each of ``items``, calling the evaluator for
+        ``batch_size`` items at a time as the values are needed.
+        """
+        for batch in self.batches(items):
+            try:
+                values = self.check(self.evaluator(batch), batch)
+            except Exception as e:
+                yield from self.resolve_singly(batch, e)
+            else:
+                yield from values
+
+    def resolve_singly(self, batch, error):
+        """
+        Yields the values of the items of a failing ``batch`` one at a time,
+        so the rows before the failing item are still written as they would
+        be by ``write_row``, and raises ``error`` if no single item fails.
+        """
+        if len(batch) == 1:
+            raise error
+        for item in batch:
+            yield self.check(self.evaluator([item]), [item])[0]
+        raise error
+
+    async def resolve_async(self, items):
+        """
+        Returns the values of ``items`` before the first failing item, and
+        the exception it raised, if any, awaiting the evaluator for every
+        ``batch_size`` items at the same time. The items of a failing batch
+        are evaluated one at a time, as for :meth:`resolve_singly`.
+        """
+        async def evaluate(batch):
+            try:
+                return self.check(
+                    await _resolve(self.evaluator(batch)), batch
+                ), None
+            except Exception as e:
+                error = e
+            values = []
+            if len(batch) > 1:
+                for item in batch:
+                    try:
+                        values.extend(self.check(
+                            await _resolve(self.evaluator([item])), [item]
+                        ))
+                    except Exception as e:
+                        return values, e
+            return values, error
+
+        values = []
+        for result, error in await asyncio.gather(
+                *map(evaluate, self.batches(items))):
+            values.extend(result)
+            if error is not None:
+                return values, error
+        return values, None
+
+    def batches(self, items):
+        return [
+            items[start:start + self.batch_size]
+            for start in range(0, len(items), self.batch_size)
+        ]
+
+    def check(self, values, batch):
+        values = list(values)
+        if len(values) != len(batch):
+            raise ValueError(
+                'Batch evaluator of column {!r} returned {} values for {} '
+                'items'.format(self.header, len(values), len(batch))
+            )
+        return values
+
+    def _compile(self, compiler):
+        return '{}[0]'.format(compiler.call(self.evaluator, '[item]'))
+
+    def _evaluate_column(self, batch):
+        return list(self.resolve(batch.source.rows()))
 
 
 class _Aggregator(_Field):
-    def __init__(self, header, evaluator, data_format, to_aggregate):
+    def __init__(self,
+                 header,
+                 evaluator,
+                 data_format,
+                 aggregate_id,
+                 to_aggregate):
         super().__init__(header, data_format)
         self.evaluator = _Field.normalise_evaluator(evaluator)
+        self.aggregate_id = aggregate_id
         self.to_aggregate = to_aggregate
 
-    def _eval(self, item: _T, row_number: int) -> _V:
-        values = (field.eval(item, row_number) for field in self.to_aggregate)
-        return self.evaluator(values)
+    def dependencies(self):
+        if not self.to_aggregate:
+            raise ValueError(
+                'Aggregator column {!r} has no columns with id {!r}'.format(
+                    self.header, self.aggregate_id
+                )
+            )
+        return self.to_aggregate
+
+    def _compile(self, compiler):
+        values = (
+            '*' + compiler.value(field) if field.spliced
+            else compiler.value(field)
+            for field in self.to_aggregate
+        )
+        return compiler.call(self.evaluator, '[{}]'.format(', '.join(values)))
+
+    def _evaluate_column(self, batch):
+        columns = [batch.values[field] for field in self.to_aggregate]
+        if not any(field.spliced for field in self.to_aggregate):
+            return list(map(self.evaluator, map(list, zip(*columns))))
+        rows = [[] for _ in range(batch.size)]
+        for field, column in zip(self.to_aggregate, columns):
+            extend = list.extend if field.spliced else list.append
+            for row, value in zip(rows, column):
+                extend(row, value)
+        return list(map(self.evaluator, rows))
 
 
 class _Counter(_Field):
@@ -195,8 +1681,17 @@ class _Counter(_Field):
         self.start = start
         self.step = step
 
-    def _eval(self, item: _T, row_number: int) -> _V:
-        return self.start + row_number * self.step
+    def _compile(self, compiler):
+        return '{} + row_number * {}'.format(
+            compiler.constant(self.start), compiler.constant(self.step)
+        )
+
+    def _evaluate_column(self, batch):
+        if type(self.start) is int and type(self.step) is int and self.step:
+            first = self.start + batch.start * self.step
+            return range(first, first + batch.size * self.step, self.step)
+        rows = range(batch.start, batch.start + batch.size)
+        return [self.start + row * self.step for row in rows]
 
 
 class _Multi(_Field):
@@ -205,6 +1700,1026 @@ class _Multi(_Field):
         self.seq_field = seq_field
         self.idx = idx
 
-    def _eval(self, item: _T, row_number: int) -> _V:
-        seq = self.seq_field.eval(item, row_number)
-        return seq[self.idx]
+    def dependencies(self):
+        return [self.seq_field]
+
+    def _compile(self, compiler):
+        return '{}[{}]'.format(compiler.value(self.seq_field), self.idx)
+
+    def _evaluate_column(self, batch):
+        return list(map(itemgetter(self.idx), batch.values[self.seq_field]))
+
+
+class _WideMulti(_Field):
+    spliced = True
+
+    def __init__(self, header_template, evaluator, num_items, data_format):
+        super().__init__(header_template, data_format)
+        self.attribute = evaluator if isinstance(evaluator, str) else None
+        self.evaluator = _Field.normalise_evaluator(evaluator)
+        self.num_items = num_items
+
+    def headers(self):
+        return [self.header.format(i) for i in range(1, self.num_items + 1)]
+
+    def dependencies(self):
+        return _evaluator_dependencies(self.evaluator)
+
+    def share_key(self):
+        key = _evaluator_key(self.evaluator, self.attribute)
+        return 'take', self.num_items, key
+
+    def take(self, values):
+        values = tuple(values)
+        if len(values) < self.num_items:
+            raise IndexError('tuple index out of range')
+        if len(values) > self.num_items:
+            values = values[:self.num_items]
+        return values
+
+    def _compile(self, compiler):
+        value = compiler.call(self.evaluator, attribute=self.attribute)
+        return '{}({})'.format(compiler.constant(self.take), value)
+
+    def _evaluate_column(self, batch):
+        values = batch.evaluate(self.evaluator, self.attribute)
+        return list(map(self.take, values))
+
+    def _format_column(self, values):
+        cells = []
+        for column in list(zip(*values)) or [()] * self.num_items:
+            cells.extend(super()._format_column(column))
+        return cells
+
+    def _compile_format(self, compiler, value):
+        if self.format_spec is None:
+            formatter = compiler.constant(self.data_format.format)
+            return 'map({}, {})'.format(formatter, value)
+        conversion, spec = self.format_spec
+        if conversion is not None:
+            value = 'map({}, {})'.format(
+                _CONVERSIONS[conversion].__name__, value
+            )
+            if not spec:
+                return value
+        if spec:
+            specs = compiler.constant((spec,) * self.num_items)
+            return 'map(format, {}, {})'.format(value, specs)
+        return 'map(format, {})'.format(value)
+
+
+class _Registered:
+    """
+    A function registered with :func:`register`, pickled by its name.
+    """
+
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+    def __call__(self, *args):
+        return self.func(*args)
+
+    def __reduce__(self):
+        return registered, (self.name,)
+
+
+class _Ref(NamedTuple):
+    names: Sequence[str]
+    func: Optional[Callable[..., Any]]
+
+
+class _Reference:
+    """
+    The evaluator of a :func:`ref` once its names are bound to the fields of
+    the named values.
+    """
+
+    def __init__(self, fields, func):
+        self.fields = fields
+        self.func = func
+
+    def compile(self, compiler):
+        values = ', '.join(map(compiler.value, self.fields))
+        if self.func is not None:
+            return compiler.call(self.func, values)
+        if len(self.fields) == 1:
+            return values
+        return '({},)'.format(values)
+
+    def evaluate_column(self, batch):
+        columns = [batch.values[field] for field in self.fields]
+        if self.func is not None:
+            return list(map(self.func, *columns))
+        if len(columns) == 1:
+            return columns[0]
+        return list(zip(*columns))
+
+
+def _evaluator_dependencies(evaluator):
+    if isinstance(evaluator, _Reference):
+        return evaluator.fields
+    return []
+
+
+def _evaluator_key(evaluator, attribute):
+    if isinstance(evaluator, _Reference):
+        return 'reference', tuple(evaluator.fields), id(evaluator.func)
+    if isinstance(evaluator, _Expression):
+        return 'expression', evaluator.canonical
+    if attribute is not None:
+        return 'attribute', attribute
+    return 'call', id(evaluator)
+
+
+class _Expression:
+    """
+    An evaluator given by :func:`expr` as a Python expression in which free
+    names are attributes of the item, such as ``'test_1 * 0.6 + test_2 * 0.4'``
+    or ``'marks[0]'``. Only operators, comparisons, conditional expressions,
+    literals, attribute access, subscripts and calls to a few builtin
+    functions are allowed.
+
+    The row function inlines the expression, with each free name replaced by
+    an attribute of the item, and columnar writes apply it to the columns
+    of its free names. Expressions are pickled as their source.
+    """
+
+    def __init__(self, source, tree):
+        self.source = source
+        self.canonical = ast.dump(tree)
+        functions = set()
+        names = []
+        for node in ast.walk(tree):
+            self._validate(node)
+            if isinstance(node, ast.Call):
+                functions.add(node.func)
+            elif isinstance(node, ast.Name):
+                names.append(node)
+        self.text = _expression_text(source)
+        # the offsets of the free names in the UTF-8 encoded text, from their
+        # lines and their offsets in those lines
+        starts = [0]
+        for line in self.text.encode('utf-8').split(b'\n'):
+            starts.append(starts[-1] + len(line) + 1)
+        self._offsets = sorted(
+            starts[node.lineno - 1] + node.col_offset
+            for node in names if node not in functions
+        )
+        self.names = list(dict.fromkeys(
+            node.id for node in names if node not in functions
+        ))
+        self.function = eval(
+            'lambda item: {}'.format(self.inline('item')), {}
+        )
+        called = {node.id for node in functions}
+        if called.isdisjoint(self.names):
+            self.column_function = eval('lambda {}: {}'.format(
+                ', '.join(self.names), _parenthesised(self.text)
+            ), {})
+        else:
+            self.column_function = None
+
+    def _validate(self, node):
+        name = type(node).__name__
+        if name not in _EXPRESSION_NODES:
+            raise ValueError('Unsupported syntax {} in expression {!r}'.format(
+                name, self.source
+            ))
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) \
+                    or node.func.id not in _EXPRESSION_FUNCTIONS:
+                raise ValueError(
+                    'Only the functions {} can be called in expression '
+                    '{!r}'.format(
+                        ', '.join(sorted(_EXPRESSION_FUNCTIONS)), self.source
+                    )
+                )
+            if any(keyword.arg is None for keyword in node.keywords):
+                raise ValueError(
+                    'Unsupported syntax ** in expression {!r}'.format(
+                        self.source
+                    )
+                )
+        name = getattr(node, 'attr', getattr(node, 'id', ''))
+        if name.startswith('_'):
+            raise ValueError(
+                'Private name {!r} in expression {!r}'.format(
+                    name, self.source
+                )
+            )
+
+    def inline(self, argument: str) -> str:
+        """
+        Returns the source of the expression with each free name read from
+        ``argument``.
+        """
+        text = self.text.encode('utf-8')
+        prefix = '{}.'.format(argument).encode('utf-8')
+        parts = []
+        start = 0
+        for offset in self._offsets:
+            parts.extend([text[start:offset], prefix])
+            start = offset
+        parts.append(text[start:])
+        return _parenthesised(b''.join(parts).decode('utf-8'))
+
+    def evaluate_column(self, batch):
+        if self.column_function is not None:
+            columns = [batch.source.column(name) for name in self.names]
+            if None not in columns:
+                if not columns:
+                    return [self.column_function() for _ in range(batch.size)]
+                return list(map(self.column_function, *columns))
+        return list(map(self.function, batch.source.rows()))
+
+    def __call__(self, item):
+        return self.function(item)
+
+    def __reduce__(self):
+        return _expression, (self.source,)
+
+
+_EXPRESSION_NODES = {
+    'Expression', 'Load', 'BinOp', 'UnaryOp', 'BoolOp', 'Compare', 'IfExp',
+    'Name', 'Attribute', 'Subscript', 'Index', 'Slice', 'ExtSlice', 'Tuple',
+    'List', 'Call', 'keyword', 'Constant', 'Num', 'Str', 'Bytes',
+    'NameConstant', 'Add', 'Sub', 'Mult', 'Div', 'FloorDiv', 'Mod', 'Pow',
+    'LShift', 'RShift', 'BitOr', 'BitXor', 'BitAnd', 'Invert', 'Not', 'UAdd',
+    'USub', 'And', 'Or', 'Eq', 'NotEq', 'Lt', 'LtE', 'Gt', 'GtE', 'Is',
+    'IsNot', 'In', 'NotIn',
+}
+_EXPRESSION_FUNCTIONS = {
+    'abs', 'all', 'any', 'bool', 'float', 'int', 'len', 'max', 'min', 'round',
+    'str', 'sum',
+}
+# parsed expressions by source, shared by every field using the same source
+_EXPRESSIONS = {}
+
+
+class _ColumnBatch:
+    """
+    The values of each field, evaluated a column at a time, for the rows of
+    a :class:`_ColumnSource` starting at row number ``start``.
+    """
+
+    def __init__(self, source: '_ColumnSource', start: int):
+        self.source = source
+        self.start = start
+        self.size = source.size
+        self.values = {}
+
+    def evaluate(self, evaluator, attribute=None) -> List:
+        if isinstance(evaluator, _Reference):
+            return evaluator.evaluate_column(self)
+        if attribute is not None:
+            column = self.source.column(attribute)
+            if column is not None:
+                return column
+        if isinstance(evaluator, _Expression):
+            return evaluator.evaluate_column(self)
+        return list(map(evaluator, self.source.rows()))
+
+
+class _ColumnSource(abc.ABC):
+    """
+    Named columns of data for ``size`` rows, loaded as lists when needed.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._columns = {}
+        self._rows = None
+
+    def column(self, name: str) -> Optional[List]:
+        if name not in self._columns:
+            self._columns[name] = self._load(name)
+        return self._columns[name]
+
+    def rows(self) -> List:
+        """
+        Returns an item for each row, with the columns as attributes, for
+        evaluators that cannot be applied to whole columns.
+        """
+        if self._rows is None:
+            names = [
+                name for name in self._names()
+                if _is_attribute_path(name) and name[0] != '_'
+                and '.' not in name
+            ]
+            row_type = namedtuple('Row', names)
+            if names:
+                columns = [self.column(name) for name in names]
+                self._rows = list(map(row_type._make, zip(*columns)))
+            else:
+                self._rows = [row_type()] * self.size
+        return self._rows
+
+    @abc.abstractmethod
+    def _names(self) -> List[str]:
+        ...
+
+    @abc.abstractmethod
+    def _load(self, name: str) -> Optional[List]:
+        ...
+
+
+class _MappingSource(_ColumnSource):
+    def __init__(self, columns, start, stop):
+        super().__init__(stop - start)
+        self.columns = columns
+        self.start = start
+        self.stop = stop
+
+    def _names(self):
+        return list(self.columns)
+
+    def _load(self, name):
+        if name not in self.columns:
+            return None
+        return _to_list(self.columns[name][self.start:self.stop])
+
+
+class _FrameSource(_ColumnSource):
+    def __init__(self, frame, start, stop):
+        super().__init__(stop - start)
+        self.frame = frame.iloc[start:stop]
+
+    def _names(self):
+        return [name for name in self.frame.columns if isinstance(name, str)]
+
+    def _load(self, name):
+        if name not in self.frame.columns:
+            return None
+        return self.frame[name].tolist()
+
+
+class _ArrowSource(_ColumnSource):
+    def __init__(self, batch):
+        super().__init__(batch.num_rows)
+        self.batch = batch
+
+    def _names(self):
+        return self.batch.schema.names
+
+    def _load(self, name):
+        index = self.batch.schema.get_field_index(name)
+        if index < 0:
+            return None
+        return self.batch.column(index).to_pylist()
+
+
+class _Plan:
+    """
+    The dependency graph of the fields of a row, flattened into the order the
+    fields are evaluated in.
+
+    Every field is placed after the fields it depends on and is given a slot,
+    its position in that order. Otherwise, fields keep the order in which the
+    columns were added. Hidden fields are only placed if a written field
+    depends on them, directly or indirectly.
+    """
+
+    def __init__(self, fields: List[_Field]):
+        self.order = []
+        self.slots = {}
+        for field in fields:
+            if not field.hidden:
+                self._visit(field, [])
+
+    def _visit(self, field, path):
+        if field in self.slots:
+            return
+        if field in path:
+            cycle = path[path.index(field):] + [field]
+            raise ValueError('Aggregation cycle between columns {}'.format(
+                ' -> '.join(repr(f.header) for f in cycle)
+            ))
+        path.append(field)
+        for dependency in field.dependencies():
+            self._visit(dependency, path)
+        path.pop()
+        self.slots[field] = len(self.order)
+        self.order.append(field)
+
+
+class _Accumulator(abc.ABC):
+    @abc.abstractmethod
+    def add(self, value):
+        ...
+
+    @abc.abstractmethod
+    def result(self):
+        ...
+
+
+class _Sum(_Accumulator):
+    def __init__(self):
+        self.total = 0
+        self.empty = True
+
+    def add(self, value):
+        self.total += value
+        self.empty = False
+
+    def result(self):
+        if self.empty:
+            return None
+        return self.total
+
+
+class _FSum(_Accumulator):
+    def __init__(self):
+        # non-overlapping partial sums, as in math.fsum
+        self.partials = []
+
+    def add(self, value):
+        partials = []
+        for partial in self.partials:
+            if abs(value) < abs(partial):
+                value, partial = partial, value
+            high = value + partial
+            low = partial - (high - value)
+            if low:
+                partials.append(low)
+            value = high
+        partials.append(value)
+        self.partials = partials
+
+    def result(self):
+        if not self.partials:
+            return None
+        return math.fsum(self.partials)
+
+
+class _Count(_Accumulator):
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+
+    def result(self):
+        return self.count
+
+
+class _Mean(_Accumulator):
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        self.total += value
+        self.count += 1
+
+    def result(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+
+class _Min(_Accumulator):
+    def __init__(self):
+        self.value = None
+
+    def add(self, value):
+        if self.value is None or value < self.value:
+            self.value = value
+
+    def result(self):
+        return self.value
+
+
+class _Max(_Accumulator):
+    def __init__(self):
+        self.value = None
+
+    def add(self, value):
+        if self.value is None or value > self.value:
+            self.value = value
+
+    def result(self):
+        return self.value
+
+
+class _Reduce(_Accumulator):
+    def __init__(self, reducer, initial):
+        self.reducer = reducer
+        self.total = initial
+
+    def add(self, value):
+        if self.total is _MISSING:
+            self.total = value
+        else:
+            self.total = self.reducer(self.total, value)
+
+    def result(self):
+        return None if self.total is _MISSING else self.total
+
+
+_ACCUMULATORS = {
+    'sum': _Sum,
+    'fsum': _FSum,
+    'count': _Count,
+    'mean': _Mean,
+    'min': _Min,
+    'max': _Max,
+}
+
+
+class ColumnProfile(NamedTuple):
+    header: str
+    calls: int
+    eval_time: float
+    format_time: float
+    output_bytes: int
+
+
+class _ColumnStats:
+    __slots__ = ('header', 'calls', 'eval_time', 'format_time', 'output_bytes')
+
+    def __init__(self, header):
+        self.header = header
+        self.calls = 0
+        self.eval_time = 0.0
+        self.format_time = 0.0
+        self.output_bytes = 0
+
+
+class CacheStats(NamedTuple):
+    header: str
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+
+
+class _LRUCache:
+    """
+    An evaluator caching the values of ``evaluator`` under ``key(item)``,
+    keeping at most ``maxsize`` of the most recently used values.
+    """
+
+    def __init__(self, evaluator, key, maxsize):
+        self.evaluator = evaluator
+        self.key = key
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._values = OrderedDict()
+        # concurrent columns are evaluated from several threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getstate__(self):
+        # the cached values and statistics are not sent to other processes
+        return self.evaluator, self.key, self.maxsize
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __call__(self, item):
+        key = self.key(item)
+        with self._lock:
+            value = self._values.get(key, _MISSING)
+            if value is not _MISSING:
+                self._values.move_to_end(key)
+                self.hits += 1
+                return value
+        value = self.evaluator(item)
+        if inspect.isawaitable(value):
+            # a task can be awaited again by later items with the same key
+            value = asyncio.ensure_future(value)
+            value.add_done_callback(
+                lambda task: self._forget_failed(key, task)
+            )
+        with self._lock:
+            self.misses += 1
+            self._values[key] = value
+            if len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def _forget_failed(self, key, task):
+        # failures are not cached, so a later item with the same key is
+        # evaluated again, as it is when a plain evaluator raises
+        if task.cancelled() or task.exception() is not None:
+            with self._lock:
+                if self._values.get(key) is task:
+                    del self._values[key]
+
+
+_worker_row_plan = None
+_worker_batched = None
+
+
+def _init_worker(fields):
+    global _worker_row_plan, _worker_batched
+    _worker_batched = [
+        field for field in _Plan(fields).order if field.batched
+    ]
+    _worker_row_plan = _RowCompiler(
+        fields, prefetched=_worker_batched
+    ).compile()
+
+
+def _build_rows(chunk, start):
+    """
+    Returns the rows of the items of ``chunk`` before the first that failed,
+    and the exception it raised, if any.
+    """
+    rows = []
+    try:
+        rows.extend(
+            _chunk_rows(_worker_row_plan, chunk, start, _worker_batched)
+        )
+    except Exception as e:
+        return rows, e
+    return rows, None
+
+
+def _chunk_rows(row, chunk, start, batched):
+    """
+    Builds the rows of ``chunk`` lazily, with the values of the ``batched``
+    fields passed to ``row`` as prefetched values.
+    """
+    numbers = range(start, start + len(chunk))
+    if not batched:
+        return map(row, chunk, numbers)
+    values = zip(*(field.resolve(chunk) for field in batched))
+    return map(row, chunk, numbers, values)
+
+
+class _RowCompiler:
+    """
+    Generates a function ``row(item, row_number)`` returning the formatted
+    data of every field for the given item, or the unformatted values if
+    ``formatted`` is false.
+
+    The values of any ``prefetched`` fields are not evaluated but taken from
+    an extra argument, ``row(item, row_number, prefetched)``, in the same
+    order.
+
+    Fields are evaluated in the order of their :class:`_Plan`, each into the
+    local variable of its slot, so the generated function does no per-field
+    dispatch or memoisation and aggregators are passed lists of values that
+    have already been evaluated.
+    """
+
+    def __init__(self,
+                 fields,
+                 asynchronous=False,
+                 observers=None,
+                 profiler=None,
+                 formatted=True,
+                 prefetched=()):
+        self.fields = fields
+        self.plan = _Plan(fields)
+        self.asynchronous = asynchronous
+        self.formatted = formatted
+        self.prefetched = {field: i for i, field in enumerate(prefetched)}
+        self.observers = observers or {}
+        self.profiler = profiler
+        self.namespace = {'_resolve': _resolve, '_clock': time.perf_counter}
+        self.lines = []
+        # calls to observers, made once the whole row has been built so that
+        # a failing row is not observed
+        self.observed = []
+        # the variable holding the value of each share key evaluated so far
+        self.shared = {}
+
+    def constant(self, value) -> str:
+        name = '_c{}'.format(len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def call(self, evaluator, argument='item', attribute=None) -> str:
+        if isinstance(evaluator, _Reference):
+            return evaluator.compile(self)
+        if isinstance(evaluator, _Registered):
+            evaluator = evaluator.func
+        if isinstance(evaluator, _Expression):
+            return evaluator.inline(argument)
+        if attribute is not None and _is_attribute_path(attribute):
+            return '{}.{}'.format(argument, attribute)
+        call = '{}({})'.format(self.constant(evaluator), argument)
+        if self.asynchronous:
+            return '(await _resolve({}))'.format(call)
+        return call
+
+    def value(self, field: _Field) -> str:
+        return 'v{}'.format(self.plan.slots[field])
+
+    def _evaluate(self, field):
+        name = self.value(field)
+        key = field.share_key()
+        if field in self.prefetched:
+            expression = 'prefetched[{}]'.format(self.prefetched[field])
+        elif key in self.shared:
+            expression = self.shared[key]
+        else:
+            expression = field._compile(self)
+        if key is not None:
+            self.shared.setdefault(key, name)
+        if self.profiler is None:
+            self.lines.append('{} = {}'.format(name, expression))
+        else:
+            stats = self.constant(self.profiler(field))
+            self.lines.extend([
+                'start = _clock()',
+                '{} = {}'.format(name, expression),
+                '{}.eval_time += _clock() - start'.format(stats),
+                '{}.calls += 1'.format(stats),
+            ])
+        if field in self.observers:
+            observer = self.constant(self.observers[field])
+            self.observed.append('{}({})'.format(observer, name))
+
+    def compile(self):
+        for field in self.plan.order:
+            self._evaluate(field)
+        cells = []
+        for field in self.fields:
+            if field.hidden:
+                continue
+            cell = self.value(field)
+            if self.formatted:
+                cell = field._compile_format(self, cell)
+                if self.profiler is not None:
+                    cell = self._profile_format(field, cell)
+            cells.append('*' + cell if field.spliced else cell)
+        cells = '[{}]'.format(', '.join(cells))
+        if self.observed:
+            self.lines.extend(['cells = ' + cells, *self.observed])
+            cells = 'cells'
+        source = '\n    '.join([
+            '{}def row(item, row_number{}):'.format(
+                'async ' if self.asynchronous else '',
+                ', prefetched' if self.prefetched else '',
+            ),
+            *self.lines,
+            'return ' + cells,
+        ])
+        exec(compile(source, '<list2csv row>', 'exec'), self.namespace)
+        return self.namespace['row']
+
+    def _profile_format(self, field, cell):
+        stats = self.constant(self.profiler(field))
+        name = 'c{}'.format(len(self.lines))
+        if field.spliced:
+            cell = 'list({})'.format(cell)
+            text = "''.join({})".format(name)
+        else:
+            text = name
+        self.lines.extend([
+            'start = _clock()',
+            '{} = {}'.format(name, cell),
+            '{}.format_time += _clock() - start'.format(stats),
+            "{}.output_bytes += len({}.encode('utf-8'))".format(stats, text),
+        ])
+        return name
+
+
+_CONVERSIONS = {'s': str, 'r': repr, 'a': ascii}
+
+
+async def _resolve(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+def _parse_format(data_format: str):
+    """
+    Returns a ``(conversion, spec)`` pair if ``data_format`` formats a single
+    value with no surrounding text, such as ``'{}'`` or ``'{:.2f}'``, so it
+    can be applied with ``format(value, spec)``. Otherwise returns ``None``
+    and ``data_format.format`` must be used.
+    """
+    try:
+        parsed = list(Formatter().parse(data_format))
+    except ValueError:
+        return None
+    if len(parsed) != 1:
+        return None
+    literal, name, spec, conversion = parsed[0]
+    if literal or name not in ('', '0') or '{' in spec:
+        return None
+    return conversion, spec
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError(
+            'pyarrow is required for Arrow and Parquet data, and can be '
+            'installed with: pip install list2csv[arrow]'
+        ) from None
+    return pyarrow
+
+
+def _is_data_frame(items) -> bool:
+    return any(
+        cls.__name__ == 'DataFrame'
+        and cls.__module__.split('.')[0] == 'pandas'
+        for cls in type(items).__mro__
+    )
+
+
+def _is_arrow_data(items) -> bool:
+    cls = type(items)
+    return (
+        cls.__name__ in ('Table', 'RecordBatch', 'RecordBatchReader')
+        and cls.__module__.split('.')[0] == 'pyarrow'
+    )
+
+
+def _arrow_batches(data) -> Iterable[Any]:
+    if type(data).__name__ == 'Table':
+        return data.to_batches()
+    if type(data).__name__ == 'RecordBatch':
+        return [data]
+    return data
+
+
+def _to_list(values) -> List:
+    # tolist gives the Python numbers and strings that items would hold, but
+    # turns other types such as datetime64 into ints or loses precision, so
+    # those keep the values of the array
+    kind = getattr(getattr(values, 'dtype', None), 'kind', None)
+    if kind is not None and kind in _TOLIST_KINDS:
+        return values.tolist()
+    return list(values)
+
+
+# the NumPy dtype kinds of booleans, numbers, bytes and str
+_TOLIST_KINDS = 'biufcSU'
+
+
+def _chunked(items, size):
+    iterator = iter(items)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def _prefetched_chunks(items, size, depth):
+    """
+    Yields the same chunks as ``_chunked``, read on a background thread into
+    a queue of at most ``depth`` chunks. Closing the generator stops the
+    thread once it has read the item it is waiting for, without waiting for
+    it to do so.
+    """
+    chunks = queue.Queue(depth)
+    stopped = threading.Event()
+
+    def put(entry):
+        # waits for space in the queue, giving up once the consumer stops
+        while not stopped.is_set():
+            try:
+                chunks.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            chunk = []
+            for item in items:
+                if stopped.is_set():
+                    return
+                chunk.append(item)
+                if len(chunk) == size:
+                    if not put((chunk, None)):
+                        return
+                    chunk = []
+            if chunk and not put((chunk, None)):
+                return
+        except BaseException as e:
+            put((None, e))
+        else:
+            put((None, None))
+
+    thread = threading.Thread(
+        target=produce, name='list2csv-prefetch', daemon=True
+    )
+    thread.start()
+    try:
+        while True:
+            chunk, error = chunks.get()
+            if chunk is None:
+                thread.join()
+                if error is not None:
+                    raise error
+                return
+            yield chunk
+    finally:
+        # a failing consumer does not wait for a slow source: the daemon
+        # thread stops after the item it is reading
+        stopped.set()
+
+
+async def _async_chunked(items, size):
+    if not hasattr(items, '__aiter__'):
+        for chunk in _chunked(items, size):
+            yield chunk
+        return
+    chunk = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _type_fields(item_type):
+    """
+    Returns the ``(name, annotation)`` of each public field of a dataclass,
+    NamedTuple or attrs class, and whether it is a NamedTuple.
+    """
+    if isinstance(item_type, type) and issubclass(item_type, tuple) \
+            and hasattr(item_type, '_fields'):
+        annotations = getattr(item_type, '__annotations__', {})
+        fields = [(name, annotations.get(name)) for name in item_type._fields]
+        is_tuple = True
+    elif hasattr(item_type, '__dataclass_fields__'):
+        import dataclasses
+        fields = [(f.name, f.type) for f in dataclasses.fields(item_type)]
+        is_tuple = False
+    elif hasattr(item_type, '__attrs_attrs__'):
+        fields = [(a.name, a.type) for a in item_type.__attrs_attrs__]
+        is_tuple = False
+    else:
+        raise TypeError(
+            '{!r} is not a dataclass, NamedTuple or attrs class'.format(
+                item_type
+            )
+        )
+    return [field for field in fields if not field[0].startswith('_')], \
+        is_tuple
+
+
+def _type_properties(item_type) -> List[str]:
+    names = {}
+    for cls in reversed(item_type.__mro__):
+        for name, value in vars(cls).items():
+            if isinstance(value, property):
+                names.setdefault(name, None)
+            else:
+                # overridden by something other than a property
+                names.pop(name, None)
+    return [name for name in names if not name.startswith('_')]
+
+
+def _is_list_type(annotation) -> bool:
+    if isinstance(annotation, str):
+        # postponed annotations, such as 'List[float]'
+        return annotation.split('[')[0].split('.')[-1] in ('list', 'List')
+    return annotation in (list, List) \
+        or getattr(annotation, '__origin__', None) in (list, List)
+
+
+def _expression_text(source: str) -> str:
+    # line endings are those the parser reads, so that the line numbers of
+    # names locate them in the text
+    return source.replace('\r\n', '\n').replace('\r', '\n').strip()
+
+
+def _parenthesised(text: str) -> str:
+    # a comment would hide a closing parenthesis on the same line
+    if '#' in text:
+        return '({}\n)'.format(text)
+    return '({})'.format(text)
+
+
+def _expression(source: str) -> _Expression:
+    """
+    Returns the expression evaluator of ``source``, parsed once for each
+    source.
+    """
+    if source not in _EXPRESSIONS:
+        try:
+            tree = ast.parse(_expression_text(source), mode='eval')
+        except SyntaxError as e:
+            raise ValueError(
+                'Invalid expression {!r}: {}'.format(source, e.msg)
+            ) from None
+        _EXPRESSIONS[source] = _Expression(source, tree)
+    return _EXPRESSIONS[source]
+
+
+def _is_attribute_path(attribute: str) -> bool:
+    return all(
+        part.isidentifier() and not keyword.iskeyword(part)
+        for part in attribute.split('.')
+    )
@@ -1,20 +1,73 @@
-from typing import TypeVar, Union, Callable, Any, Iterable, Generic, TextIO
+from multiprocessing.context import BaseContext
+from typing import (
+    TypeVar, Union, Callable, Any, Iterable, AsyncIterable, Generic, TextIO,
+    List, NamedTuple, BinaryIO, Mapping, Sequence, Type, overload,
+)
 
 _T = TypeVar('_T')
 _V = TypeVar('_V')
 
-_eval_func = Union[Callable[[_T], Any], str]
-_multi_eval_func = Union[Callable[[_T], Iterable], str]
+
+class _Ref: ...
+
+
+class _Registered:
+    name: str
+    def __call__(self, *args: Any) -> Any: ...
+
+
+class _Expression:
+    source: str
+    def __call__(self, item: Any) -> Any: ...
+
+
+_eval_func = Union[Callable[[_T], Any], str, _Ref, _Registered, _Expression]
+_multi_eval_func = Union[Callable[[_T], Iterable], str, _Ref, _Expression]
 _aggregate_func = Callable[[Iterable[_T]], Any]
+_reduce_func = Callable[[Any, Any], Any]
+
+
+def ref(*names: str, func: Callable[..., Any] = ...) -> _Ref: ...
+@overload
+def register(name: str) -> Callable[[Callable[..., Any]], _Registered]: ...
+@overload
+def register(name: str, func: Callable[..., Any]) -> _Registered: ...
+def registered(name: str) -> _Registered: ...
+def expr(source: str) -> _Expression: ...
+
+
+class ColumnProfile(NamedTuple):
+    header: str
+    calls: int
+    eval_time: float
+    format_time: float
+    output_bytes: int
+
 
+class CacheStats(NamedTuple):
+    header: str
+    hits: int
+    misses: int
+    evictions: int
+    size: int
 
-class Writer(Generic[_T]):
-    def __init__(self, f: TextIO): ...
+
+class _ColumnSet(Generic[_T]):
     def add_column(self,
                    header: str,
                    evaluator: _eval_func,
                    data_format: str = '{}',
-                   aggregate_ids: set = ...): ...
+                   aggregate_ids: set = ...,
+                   concurrent: bool = False,
+                   cache_key: _eval_func = ...,
+                   cache_size: int = 1024,
+                   hidden: bool = False): ...
+    def add_batch_column(self,
+                         header: str,
+                         batch_evaluator: Callable[[List[_T]], Sequence],
+                         batch_size: int = 256,
+                         data_format: str = '{}',
+                         aggregate_ids: set = ...): ...
     def add_aggregator(self,
                        aggregate_id: Any,
                        header: str,
@@ -31,7 +84,109 @@ class Writer(Generic[_T]):
                   evaluator: _multi_eval_func,
                   num_items: int,
                   data_format: str = '{}',
+                  aggregate_ids: set = ...,
+                  hidden: bool = False): ...
+    def add_wide_multi(self,
+                       header_template: str,
+                       evaluator: _multi_eval_func,
+                       num_items: int,
+                       data_format: str = '{}',
+                       aggregate_ids: set = ...,
+                       hidden: bool = False): ...
+    def add_value(self,
+                  name: str,
+                  evaluator: _eval_func,
                   aggregate_ids: set = ...): ...
+    def add_type(self,
+                 item_type: type,
+                 headers: Mapping[str, str] = ...,
+                 formats: Mapping[str, str] = ...,
+                 widths: Mapping[str, int] = ...,
+                 exclude: Iterable[str] = ...,
+                 properties: bool = True): ...
+    def compile(self): ...
+    def cache_report(self) -> List[CacheStats]: ...
+
+
+class Schema(_ColumnSet[_T]):
+    def fingerprint(self) -> str: ...
+
+
+class Writer(_ColumnSet[_T]):
+    @classmethod
+    def from_type(cls,
+                  item_type: Type[_T],
+                  f: TextIO,
+                  headers: Mapping[str, str] = ...,
+                  formats: Mapping[str, str] = ...,
+                  widths: Mapping[str, int] = ...,
+                  exclude: Iterable[str] = ...,
+                  properties: bool = True,
+                  profile: bool = False) -> 'Writer[_T]': ...
+    def __init__(self,
+                 f: TextIO,
+                 profile: bool = False,
+                 schema: Schema[_T] = ...): ...
+    @classmethod
+    def open(cls,
+             path: str,
+             compression: str = ...,
+             compresslevel: int = ...,
+             encoding: str = 'utf-8',
+             buffer_size: int = 1 << 20,
+             profile: bool = False,
+             schema: Schema[_T] = ...) -> 'Writer[_T]': ...
+    def close(self): ...
+    def __enter__(self) -> 'Writer[_T]': ...
+    def __exit__(self, *exc_info): ...
+    def add_footer(self,
+                   header: str,
+                   accumulator: Union[str, _reduce_func] = 'sum',
+                   data_format: str = '{}',
+                   initial: Any = ...): ...
+    def write_footer(self, headers: Sequence[str] = ...): ...
+    def write_header(self, headers: Sequence[str] = ...): ...
+    def write_row(self, item: _T, headers: Sequence[str] = ...): ...
+    def write_all(self,
+                  items: Iterable[_T],
+                  chunk_size: int = ...,
+                  workers: int = ...,
+                  threads: int = ...,
+                  prefetch: int = 0,
+                  headers: Sequence[str] = ...,
+                  mp_context: BaseContext = ...): ...
+    def write_columns(self,
+                      columns: Mapping[str, Sequence],
+                      chunk_size: int = 16384,
+                      headers: Sequence[str] = ...): ...
+    def write_frame(self,
+                    frame: Any,
+                    chunk_size: int = 16384,
+                    headers: Sequence[str] = ...): ...
+    def write_batches(self,
+                      batches: Iterable[Any],
+                      chunk_size: int = 16384,
+                      headers: Sequence[str] = ...): ...
+    def profile_report(self) -> List[ColumnProfile]: ...
+
+
+class AsyncWriter(_ColumnSet[_T]):
+    def __init__(self, f: TextIO, concurrency: int = 16): ...
     def write_header(self): ...
+    async def write_row(self, item: _T): ...
+    async def write_all(self,
+                        items: Union[Iterable[_T], AsyncIterable[_T]],
+                        chunk_size: int = 1024): ...
+
+
+class ArrowWriter(_ColumnSet[_T]):
+    def __init__(self,
+                 sink: Union[str, BinaryIO],
+                 file_format: str = 'parquet',
+                 row_group_size: int = 65536,
+                 types: Mapping[str, Any] = ...): ...
     def write_row(self, item: _T): ...
-    def write_all(self, items: Iterable[_T]): ...
+    def write_all(self, items: Iterable[_T], chunk_size: int = 1024): ...
+    def close(self): ...
+    def __enter__(self) -> 'ArrowWriter[_T]': ...
+    def __exit__(self, *exc_info): ...
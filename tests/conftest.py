@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from helpers import make_students  # noqa: E402
+
+
+@pytest.fixture
+def students():
+    return make_students(45)
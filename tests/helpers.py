@@ -0,0 +1,66 @@
+"""
+Items and helpers shared by the tests.
+"""
+import io
+from dataclasses import dataclass
+from statistics import mean
+from types import SimpleNamespace
+from typing import List
+
+
+@dataclass
+class Student:
+    student_id: str
+    test_1_mark: float
+    test_2_mark: float
+    assignment_marks: List[float]
+    lab_marks: List[float]
+    comments: List[str]
+    address: SimpleNamespace
+
+    @property
+    def grade(self):
+        return (60 * mean((self.test_1_mark, self.test_2_mark))
+                + 30 * mean(self.assignment_marks)
+                + 10 * mean(self.lab_marks)) / 100
+
+
+def make_students(count):
+    comments = [
+        ['Good', 'Needs work on classes'],
+        ['Needs work on "formatting"', 'Commas, and\nnewlines'],
+        [],
+    ]
+    return [
+        Student(
+            'id{:03}'.format(i),
+            50 + i % 7 * 7.25,
+            100 - i % 11 * 3.5,
+            [60 + i % 3, 70.5 + i % 5, 99],
+            [i % 10 * 10.1, 100, 0.5, i / 3],
+            comments[i % 3],
+            SimpleNamespace(city='City {}'.format(i % 4), code=i % 4),
+        )
+        for i in range(count)
+    ]
+
+
+class Failing:
+    """
+    An item whose attributes all raise ``KeyError``.
+    """
+
+    def __getattr__(self, name):
+        raise KeyError(name)
+
+
+def output(writer_type, configure, write, **options) -> str:
+    """
+    Returns the text written by a writer of ``writer_type`` configured by
+    ``configure(writer)`` and written by ``write(writer)``.
+    """
+    f = io.StringIO()
+    writer = writer_type(f, **options)
+    configure(writer)
+    write(writer)
+    return f.getvalue()
@@ -0,0 +1,247 @@
+"""
+An interpretive reference for the writers of list2csv.
+
+Every cell of every row is evaluated by walking the configured columns,
+with no code generation, sharing, batching, caching or concurrency, so the
+output of this writer defines the bytes the compiled writers must produce.
+It takes the same configuration calls as ``list2csv.Writer``, ignoring the
+options that only change how values are evaluated.
+"""
+import builtins
+import csv
+import math
+from collections import defaultdict
+
+_EXPRESSION_FUNCTIONS = {
+    'abs', 'all', 'any', 'bool', 'float', 'int', 'len', 'max', 'min', 'round',
+    'str', 'sum',
+}
+_MISSING = object()
+
+
+class _Ref:
+    def __init__(self, names, func):
+        self.names = names
+        self.func = func
+
+
+def ref(*names, func=None):
+    return _Ref(names, func)
+
+
+def expr(source):
+    code = compile(source, '<expression>', 'eval')
+    functions = {name: getattr(builtins, name) for name in _EXPRESSION_FUNCTIONS}
+
+    def evaluate(item):
+        # names are read before evaluating, as eval would take a KeyError
+        # raised by a mapping of names for a missing name
+        names = {}
+        for name in code.co_names:
+            if name not in functions:
+                try:
+                    names[name] = getattr(item, name)
+                except AttributeError:
+                    # the name of an attribute of another value
+                    pass
+        return eval(code, {'__builtins__': functions}, names)
+
+    return evaluate
+
+
+class _Column:
+    def __init__(self, headers, evaluate, data_format='{}', hidden=False,
+                 spliced=False):
+        self.headers = headers
+        # evaluate(item, row_number, value) where value(column) returns the
+        # value of another column for the same row
+        self.evaluate = evaluate
+        self.data_format = data_format
+        self.hidden = hidden
+        self.spliced = spliced
+
+    def cells(self, value):
+        if self.spliced:
+            return [self.data_format.format(v) for v in value]
+        return [self.data_format.format(value)]
+
+    def aggregated(self, value):
+        return list(value) if self.spliced else [value]
+
+
+class Writer:
+    def __init__(self, f):
+        self._writer = csv.writer(f)
+        self._columns = []
+        self._to_aggregate = defaultdict(list)
+        self._values = {}
+        self._footers = {}
+        self._row_count = 0
+
+    def add_column(self, header, evaluator, data_format='{}',
+                   aggregate_ids=frozenset(), concurrent=False,
+                   cache_key=None, cache_size=1024, hidden=False):
+        evaluate = self._evaluator(evaluator)
+        self._add(_Column(
+            [header], lambda item, row, value: evaluate(item, value),
+            data_format, hidden
+        ), aggregate_ids)
+
+    def add_batch_column(self, header, batch_evaluator, batch_size=256,
+                         data_format='{}', aggregate_ids=frozenset()):
+        self.add_column(
+            header, lambda item: list(batch_evaluator([item]))[0],
+            data_format, aggregate_ids
+        )
+
+    def add_aggregator(self, aggregate_id, header, aggregate_evaluator,
+                       data_format='{}', aggregate_ids=frozenset()):
+        to_aggregate = self._to_aggregate[aggregate_id]
+
+        def evaluate(item, row, value):
+            values = []
+            for column in to_aggregate:
+                values.extend(column.aggregated(value(column)))
+            return aggregate_evaluator(values)
+
+        self._add(_Column([header], evaluate, data_format), aggregate_ids)
+
+    def add_counter(self, header, start=1, step=1, aggregate_ids=frozenset()):
+        self._add(_Column(
+            [header], lambda item, row, value: start + row * step
+        ), aggregate_ids)
+
+    def add_multi(self, header_template, evaluator, num_items,
+                  data_format='{}', aggregate_ids=frozenset(), hidden=False):
+        evaluate = self._evaluator(evaluator)
+        sequence = _Column(
+            [], lambda item, row, value: tuple(evaluate(item, value)),
+            hidden=True
+        )
+        for i in range(num_items):
+            self._add(_Column(
+                [header_template.format(i + 1)],
+                lambda item, row, value, i=i: value(sequence)[i],
+                data_format, hidden
+            ), aggregate_ids)
+
+    def add_wide_multi(self, header_template, evaluator, num_items,
+                       data_format='{}', aggregate_ids=frozenset(),
+                       hidden=False):
+        evaluate = self._evaluator(evaluator)
+
+        def take(item, row, value):
+            values = tuple(evaluate(item, value))
+            return tuple(values[i] for i in range(num_items))
+
+        headers = [header_template.format(i) for i in range(1, num_items + 1)]
+        self._add(_Column(
+            headers, take, data_format, hidden, spliced=True
+        ), aggregate_ids)
+
+    def add_value(self, name, evaluator, aggregate_ids=frozenset()):
+        evaluate = self._evaluator(evaluator)
+        column = _Column(
+            [name], lambda item, row, value: evaluate(item, value), hidden=True
+        )
+        self._add(column, aggregate_ids)
+        self._values[name] = column
+
+    def add_footer(self, header, accumulator='sum', data_format='{}',
+                   initial=_MISSING):
+        self._footers[self._find(header)] = (
+            accumulator, data_format, initial, []
+        )
+
+    def write_header(self, headers=None):
+        row = []
+        for column in self._selected(headers):
+            row.extend(column.headers)
+        self._writer.writerow(row)
+
+    def write_row(self, item, headers=None):
+        values = {}
+
+        def value(column):
+            if column not in values:
+                values[column] = column.evaluate(item, self._row_count, value)
+            return values[column]
+
+        row = []
+        for column in self._selected(headers):
+            row.extend(column.cells(value(column)))
+        for column, (_, _, _, accumulated) in self._footers.items():
+            if column in values:
+                accumulated.append(values[column])
+        self._writer.writerow(row)
+        self._row_count += 1
+
+    def write_all(self, items, headers=None, **options):
+        for item in items:
+            self.write_row(item, headers)
+
+    def write_footer(self, headers=None):
+        row = []
+        for column in self._selected(headers):
+            if column not in self._footers:
+                row.extend([''] * len(column.headers))
+                continue
+            accumulator, data_format, initial, values = self._footers[column]
+            total = _accumulate(accumulator, initial, values)
+            row.append('' if total is None else data_format.format(total))
+        self._writer.writerow(row)
+
+    def _evaluator(self, evaluator):
+        if isinstance(evaluator, _Ref):
+            columns = [self._values[name] for name in evaluator.names]
+
+            def evaluate(item, value):
+                values = [value(column) for column in columns]
+                if evaluator.func is not None:
+                    return evaluator.func(*values)
+                return values[0] if len(values) == 1 else tuple(values)
+
+            return evaluate
+        if isinstance(evaluator, str):
+            def evaluate(item, value):
+                for name in evaluator.split('.'):
+                    item = getattr(item, name)
+                return item
+
+            return evaluate
+        return lambda item, value: evaluator(item)
+
+    def _add(self, column, aggregate_ids):
+        self._columns.append(column)
+        for id_ in aggregate_ids:
+            self._to_aggregate[id_].append(column)
+
+    def _find(self, header):
+        for column in self._columns:
+            if not column.hidden and header in column.headers:
+                return column
+        raise ValueError('No column named {!r}'.format(header))
+
+    def _selected(self, headers):
+        if headers is None:
+            return [column for column in self._columns if not column.hidden]
+        return list(dict.fromkeys(map(self._find, headers)))
+
+
+def _accumulate(accumulator, initial, values):
+    if callable(accumulator):
+        total = initial
+        for value in values:
+            total = value if total is _MISSING else accumulator(total, value)
+        return None if total is _MISSING else total
+    if accumulator == 'count':
+        return len(values)
+    if not values:
+        return None
+    if accumulator == 'sum':
+        return sum(values)
+    if accumulator == 'fsum':
+        return math.fsum(values)
+    if accumulator == 'mean':
+        return sum(values) / len(values)
+    return {'min': min, 'max': max}[accumulator](values)
@@ -0,0 +1,91 @@
+import pytest
+
+import list2csv
+
+pyarrow = pytest.importorskip('pyarrow')
+pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+
+
+def read(sink, file_format='parquet'):
+    data = pyarrow.BufferReader(sink.getvalue())
+    if file_format == 'ipc':
+        return pyarrow.ipc.open_file(data).read_all()
+    return pyarrow_parquet.read_table(data)
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'ipc'])
+def test_values_match_items(students, file_format):
+    calls = []
+
+    def lookup(items):
+        calls.append(len(items))
+        return [s.student_id for s in items]
+
+    sink = pyarrow.BufferOutputStream()
+    with list2csv.ArrowWriter(sink, file_format, row_group_size=8) as writer:
+        writer.add_counter('N')
+        writer.add_column('Test 1', 'test_1_mark', aggregate_ids={'t'})
+        writer.add_column('Test 2', lambda s: s.test_2_mark,
+                          aggregate_ids={'t'})
+        writer.add_aggregator('t', 'Max', max)
+        writer.add_batch_column('ID', lookup, 10)
+        writer.add_multi('A{}', 'assignment_marks', 2)
+        writer.write_row(students[0])
+        writer.write_all(students[1:], chunk_size=20)
+    assert calls == [1, 10, 10, 10, 10, 4]
+    assert read(sink, file_format).to_pylist() == [
+        {
+            'N': i + 1,
+            'Test 1': s.test_1_mark,
+            'Test 2': s.test_2_mark,
+            'Max': max(s.test_1_mark, s.test_2_mark),
+            'ID': s.student_id,
+            'A1': s.assignment_marks[0],
+            'A2': s.assignment_marks[1],
+        }
+        for i, s in enumerate(students)
+    ]
+
+
+def test_no_rows():
+    sink = pyarrow.BufferOutputStream()
+    with list2csv.ArrowWriter(sink) as writer:
+        writer.add_column('V', lambda item: item)
+    assert read(sink).num_rows == 0
+
+
+def test_types():
+    items = [None] * 3 + [1.5, 2, 3]
+    sink = pyarrow.BufferOutputStream()
+    with list2csv.ArrowWriter(
+            sink, row_group_size=3, types={'V': pyarrow.float64()}) as writer:
+        writer.add_column('V', lambda item: item)
+        writer.write_all(items)
+    table = read(sink)
+    assert table.schema.field('V').type == pyarrow.float64()
+    assert table.column('V').to_pylist() == [None] * 3 + [1.5, 2.0, 3.0]
+
+
+def test_inferred_type_that_does_not_fit():
+    writer = list2csv.ArrowWriter(
+        pyarrow.BufferOutputStream(), row_group_size=2
+    )
+    writer.add_column('V', lambda item: item)
+    with pytest.raises(ValueError, match="'V'"):
+        writer.write_all([None, None, 1, 2])
+
+
+def test_types_of_unknown_headers():
+    writer = list2csv.ArrowWriter(
+        pyarrow.BufferOutputStream(), types={'W': pyarrow.int8()}
+    )
+    writer.add_column('V', lambda item: item)
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+def test_invalid_options():
+    with pytest.raises(ValueError):
+        list2csv.ArrowWriter(pyarrow.BufferOutputStream(), 'csv')
+    with pytest.raises(ValueError):
+        list2csv.ArrowWriter(pyarrow.BufferOutputStream(), row_group_size=0)
@@ -0,0 +1,138 @@
+import asyncio
+import io
+
+import pytest
+
+import list2csv
+import reference
+from helpers import Failing, output
+from test_writer import grades, nested
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def awaited(func):
+    async def evaluate(argument):
+        await asyncio.sleep(0)
+        return func(argument)
+
+    return evaluate
+
+
+def lookups(w, lib, asynchronous=False):
+    """
+    Columns whose evaluators are coroutine functions when ``asynchronous``
+    is true, and plain functions with the same results otherwise.
+    """
+    evaluator = awaited if asynchronous else lambda func: func
+    w.add_counter('N')
+    w.add_column('Doubled', evaluator(lambda s: s.test_1_mark * 2), '{:.1f}',
+                 {'l'})
+    w.add_batch_column(
+        'Batch', evaluator(lambda items: [s.student_id for s in items]), 3
+    )
+    w.add_value('labs', evaluator(lambda s: s.lab_marks))
+    w.add_multi('L{}', lib.ref('labs'), 2, '{:.2f}', {'l'})
+    w.add_aggregator('l', 'Total', sum, '{:.2f}')
+
+
+def expected(configure, items):
+    def write(writer):
+        writer.write_header()
+        writer.write_all(items)
+
+    return output(reference.Writer, lambda w: configure(w, reference), write)
+
+
+def written(configure, items, write, f=None, **options):
+    if f is None:
+        f = io.StringIO()
+    writer = list2csv.AsyncWriter(f, **options)
+    configure(writer)
+    writer.write_header()
+    run(write(writer, items))
+    return f.getvalue()
+
+
+async def write_all(writer, items):
+    await writer.write_all(items, chunk_size=7)
+
+
+async def write_rows(writer, items):
+    for item in items:
+        await writer.write_row(item)
+
+
+async def write_iterable(writer, items):
+    async def iterate():
+        for item in items:
+            await asyncio.sleep(0)
+            yield item
+
+    await writer.write_all(iterate(), chunk_size=5)
+
+
+WRITES = [write_all, write_rows, write_iterable]
+
+
+@pytest.mark.parametrize('configure', [grades, nested])
+@pytest.mark.parametrize('write', WRITES)
+def test_matches_reference(students, configure, write):
+    assert written(
+        lambda w: configure(w, list2csv), students, write, concurrency=3
+    ) == expected(configure, students)
+
+
+@pytest.mark.parametrize('write', WRITES)
+def test_coroutine_evaluators(students, write):
+    assert written(
+        lambda w: lookups(w, list2csv, asynchronous=True), students, write
+    ) == expected(lookups, students)
+
+
+@pytest.mark.parametrize('configure, options', [
+    (grades, {}),
+    (lookups, {}),
+    (lookups, {'asynchronous': True}),
+])
+@pytest.mark.parametrize('concurrency', [1, 4, 16])
+def test_failing_item_writes_the_rows_before_it(students, configure, options,
+                                                concurrency):
+    f = io.StringIO()
+    items = students[:11] + [Failing()] + students[11:]
+    with pytest.raises(KeyError):
+        written(lambda w: configure(w, list2csv, **options), items, write_all,
+                f, concurrency=concurrency)
+    assert f.getvalue() == expected(configure, students[:11])
+
+
+def test_failures_are_not_cached():
+    calls = []
+
+    async def lookup(item):
+        calls.append(item)
+        await asyncio.sleep(0)
+        if len(calls) == 1:
+            raise LookupError(item)
+        return item * 2
+
+    async def write(writer):
+        with pytest.raises(LookupError):
+            await writer.write_row(1)
+        await writer.write_row(1)
+        await writer.write_row(1)
+
+    f = io.StringIO()
+    writer = list2csv.AsyncWriter(f)
+    writer.add_column('V', lookup, cache_key=lambda item: item)
+    run(write(writer))
+    assert calls == [1, 1]
+    assert f.getvalue() == '2\r\n2\r\n'
+    [stats] = writer.cache_report()
+    assert (stats.misses, stats.hits) == (2, 1)
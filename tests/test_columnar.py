@@ -0,0 +1,246 @@
+import io
+import multiprocessing
+from types import SimpleNamespace
+
+import pytest
+
+import list2csv
+import reference
+from helpers import output
+from test_writer import expressions, grades, nested, values
+
+NAMES = [
+    'student_id', 'test_1_mark', 'test_2_mark', 'assignment_marks',
+    'lab_marks', 'comments', 'address', 'grade',
+]
+
+
+def columns_of(items):
+    return {name: [getattr(item, name) for item in items] for name in NAMES}
+
+
+def rows_of(items):
+    return [
+        SimpleNamespace(**{name: getattr(item, name) for name in NAMES})
+        for item in items
+    ]
+
+
+@pytest.mark.parametrize('configure', [grades, nested, expressions])
+@pytest.mark.parametrize('chunk_size', [1, 7, 16384])
+def test_columns_match_reference(students, configure, chunk_size):
+    def write(items):
+        def run(writer):
+            writer.write_header()
+            writer.write_row(items[0])
+            if isinstance(writer, reference.Writer):
+                writer.write_all(items[1:])
+            else:
+                writer.write_columns(columns_of(items[1:]), chunk_size)
+            writer.write_row(items[0])
+
+        return run
+
+    assert output(
+        list2csv.Writer, lambda w: configure(w, list2csv),
+        write(students)
+    ) == output(
+        reference.Writer, lambda w: configure(w, reference),
+        write(rows_of(students))
+    )
+
+
+@pytest.mark.parametrize('configure, headers', [
+    (values, ['Sum', 'Diff']),
+    (grades, ['Lab 2', 'ID', 'Av Test Mark']),
+])
+def test_selected_columns_match_reference(students, configure, headers):
+    def run(writer):
+        writer.write_header(headers)
+        if isinstance(writer, reference.Writer):
+            writer.write_all(rows_of(students), headers)
+        else:
+            writer.write_columns(columns_of(students), 7, headers)
+
+    assert output(
+        list2csv.Writer, lambda w: configure(w, list2csv), run
+    ) == output(
+        reference.Writer, lambda w: configure(w, reference), run
+    )
+
+
+def test_columns_of_different_lengths(students):
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_column('ID', 'student_id')
+    columns = columns_of(students)
+    columns['grade'] = columns['grade'][1:]
+    with pytest.raises(ValueError):
+        writer.write_columns(columns)
+
+
+def test_arrays_match_reference():
+    numpy = pytest.importorskip('numpy')
+    columns = {
+        'when': numpy.array(
+            ['2020-01-01T00:00:00.000000001', '1999-12-31T23:59:59'],
+            dtype='datetime64[ns]'
+        ),
+        'took': numpy.array([1500, 3], dtype='timedelta64[ms]'),
+        'mark': numpy.array([0.1, 2.5], dtype=numpy.float64),
+        'count': numpy.array([1, 2], dtype=numpy.int8),
+        'name': numpy.array(['a', 'bc']),
+        'other': numpy.array([None, (1, 2)], dtype=object),
+    }
+
+    def configure(w, lib):
+        for name in columns:
+            w.add_column(name, name)
+        w.add_column('Later', lambda item: item.when + item.took)
+
+    def run(writer):
+        if isinstance(writer, reference.Writer):
+            writer.write_all(
+                SimpleNamespace(**dict(zip(columns, values)))
+                for values in zip(*columns.values())
+            )
+        else:
+            writer.write_columns(columns)
+
+    assert output(
+        list2csv.Writer, lambda w: configure(w, list2csv), run
+    ) == output(
+        reference.Writer, lambda w: configure(w, reference), run
+    )
+
+
+def marks(w, lib):
+    w.add_counter('N', 5, 2, {'n'})
+    w.add_column('Test 1', 'test_1_mark', '{:.1f}', {'n'})
+    w.add_column('Test 2', 'test_2_mark', aggregate_ids={'n'})
+    w.add_aggregator('n', 'Sum', sum, '{:.2f}')
+    w.add_column('Grade', lambda item: item.grade, '{:.2f}')
+
+
+@pytest.mark.parametrize('options', [{}, {'chunk_size': 6}])
+def test_frame_matches_reference(students, options):
+    pandas = pytest.importorskip('pandas')
+    frame = pandas.DataFrame(columns_of(students))
+
+    def run(writer):
+        writer.write_header()
+        if isinstance(writer, reference.Writer):
+            writer.write_all(frame.itertuples(index=False))
+        else:
+            writer.write_all(frame, **options)
+
+    assert output(
+        list2csv.Writer, lambda w: marks(w, list2csv), run
+    ) == output(
+        reference.Writer, lambda w: marks(w, reference), run
+    )
+
+
+@pytest.mark.parametrize('options, sizes', [
+    ({}, [16384, 3616]),
+    ({'chunk_size': 15000}, [15000, 5000]),
+])
+def test_frame_chunk_size(options, sizes):
+    pandas = pytest.importorskip('pandas')
+    calls = []
+
+    def evaluate(items):
+        calls.append(len(items))
+        return [item.v for item in items]
+
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_batch_column('V', evaluate, batch_size=1 << 20)
+    writer.write_all(pandas.DataFrame({'v': range(20000)}), **options)
+    assert calls == sizes
+
+
+@pytest.mark.parametrize('option', [
+    {'workers': 2},
+    {'threads': 2},
+    {'prefetch': 1},
+    {'mp_context': multiprocessing.get_context()},
+])
+def test_frame_with_row_options(option):
+    pandas = pytest.importorskip('pandas')
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_column('V', 'v')
+    with pytest.raises(ValueError, match='DataFrame'):
+        writer.write_all(pandas.DataFrame({'v': [1, 2]}), **option)
+
+
+def arrow_table(pyarrow, items):
+    data = columns_of(items)
+    return pyarrow.table({
+        name: data[name] for name in NAMES if name != 'address'
+    })
+
+
+def arrow_rows(table):
+    # Arrow converts the ints in lists of floats to floats
+    return [SimpleNamespace(**row) for row in table.to_pylist()]
+
+
+@pytest.mark.parametrize('configure', [marks, nested])
+@pytest.mark.parametrize('chunk_size', [4, 16384])
+def test_arrow_batches_match_reference(students, configure, chunk_size):
+    pyarrow = pytest.importorskip('pyarrow')
+    table = arrow_table(pyarrow, students)
+
+    def run(writer):
+        writer.write_header()
+        if isinstance(writer, reference.Writer):
+            writer.write_all(arrow_rows(table))
+        else:
+            writer.write_batches(table.to_batches(max_chunksize=10),
+                                 chunk_size)
+
+    assert output(
+        list2csv.Writer, lambda w: configure(w, list2csv), run
+    ) == output(
+        reference.Writer, lambda w: configure(w, reference), run
+    )
+
+
+@pytest.mark.parametrize('kind', ['Table', 'RecordBatch', 'RecordBatchReader'])
+def test_write_all_of_arrow_data(students, kind):
+    pyarrow = pytest.importorskip('pyarrow')
+    table = arrow_table(pyarrow, students)
+    data = {
+        'Table': table,
+        'RecordBatch': table.combine_chunks().to_batches()[0],
+        'RecordBatchReader': pyarrow.RecordBatchReader.from_batches(
+            table.schema, table.to_batches(max_chunksize=7)
+        ),
+    }[kind]
+
+    def run(writer):
+        writer.write_header()
+        if isinstance(writer, reference.Writer):
+            writer.write_all(arrow_rows(table))
+        else:
+            writer.write_all(data)
+
+    assert output(
+        list2csv.Writer, lambda w: marks(w, list2csv), run
+    ) == output(
+        reference.Writer, lambda w: marks(w, reference), run
+    )
+
+
+def test_arrow_chunks_do_not_span_batches():
+    pyarrow = pytest.importorskip('pyarrow')
+    calls = []
+
+    def evaluate(items):
+        calls.append(len(items))
+        return [item.v for item in items]
+
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_batch_column('V', evaluate, batch_size=1 << 20)
+    table = pyarrow.table({'v': list(range(25))})
+    writer.write_batches(table.to_batches(max_chunksize=10), chunk_size=4)
+    assert calls == [4, 4, 2, 4, 4, 2, 4, 1]
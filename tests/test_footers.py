@@ -0,0 +1,173 @@
+import io
+import multiprocessing
+import operator
+
+import pytest
+
+import list2csv
+from helpers import Failing
+from test_writer import WRITES, actual, expected, grades, values
+
+# footers are not accumulated by worker processes
+SERIAL_WRITES = {
+    name: write for name, write in WRITES.items() if name != 'workers'
+}
+
+
+def footers(w, lib):
+    grades(w, lib)
+    w.add_footer('Student Num', 'count')
+    w.add_footer('Test 1', 'sum', '{:.2f}')
+    w.add_footer('Test 2', 'fsum')
+    w.add_footer('Assignment 2', 'mean', '{:.3f}')
+    w.add_footer('Av Test Mark', 'min')
+    w.add_footer('Grade', 'max', '{:.1f}')
+    w.add_footer('ID', operator.add, initial='>')
+    w.add_footer('City', lambda total, city: total + city[-1])
+
+
+@pytest.mark.parametrize('write', SERIAL_WRITES.values(),
+                         ids=list(SERIAL_WRITES))
+def test_footers_match_reference(students, write):
+    def run(writer):
+        writer.write_header()
+        writer.write_footer()
+        write(writer, students)
+        writer.write_footer()
+
+    assert actual(footers, run) == expected(footers, run)
+
+
+@pytest.mark.parametrize('write', SERIAL_WRITES.values(),
+                         ids=list(SERIAL_WRITES))
+def test_failing_item(students, write):
+    items = students[:11] + [Failing()] + students[11:]
+
+    def run(writer):
+        with pytest.raises(KeyError):
+            write(writer, items)
+        writer.write_all(students[:3])
+        writer.write_footer()
+
+    assert actual(footers, run) == expected(footers, run)
+
+
+def concurrent(w, lib):
+    w.add_counter('N')
+    w.add_column('Slow', lambda s: s.test_1_mark, '{:.1f}', concurrent=True)
+    w.add_column('ID', 'student_id')
+    w.add_footer('Slow', 'sum')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 100])
+def test_failing_concurrent_item(students, chunk_size):
+    items = students[:11] + [Failing()] + students[11:]
+
+    def run(writer):
+        with pytest.raises(KeyError):
+            writer.write_all(items, chunk_size=chunk_size, threads=2)
+        writer.write_footer()
+
+    assert actual(concurrent, run) == expected(concurrent, run)
+
+
+HEADERS = [
+    ['Grade', 'ID'],
+    ['Av Test Mark', 'Student Num'],
+    ['Lab 3', 'Test 2', 'Av. Lab Mark'],
+    ['Assignment 2', 'Lab 1', 'Lab 2'],
+    [],
+]
+
+
+OPTIONS = [
+    None, {}, {'chunk_size': 7}, {'chunk_size': 5, 'prefetch': 2},
+    {'chunk_size': 6, 'threads': 3},
+]
+
+
+@pytest.mark.parametrize('headers', HEADERS)
+@pytest.mark.parametrize('options', OPTIONS)
+def test_selected_headers(students, headers, options):
+    def run(writer):
+        writer.write_header(headers)
+        if options is None:
+            for item in students:
+                writer.write_row(item, headers)
+        else:
+            writer.write_all(students, headers=headers, **options)
+        writer.write_row(students[0])
+        writer.write_footer(headers)
+        writer.write_footer()
+
+    assert actual(footers, run) == expected(footers, run)
+
+
+VALUES_OPTIONS = [{'chunk_size': 4}]
+# lambda evaluators can only be sent to forked worker processes
+if 'fork' in multiprocessing.get_all_start_methods():
+    VALUES_OPTIONS.append({
+        'chunk_size': 4, 'workers': 2,
+        'mp_context': multiprocessing.get_context('fork'),
+    })
+
+
+@pytest.mark.parametrize('options', VALUES_OPTIONS)
+def test_selected_headers_of_values(students, options):
+    headers = ['Sum', 'Diff']
+
+    def run(writer):
+        writer.write_header(headers)
+        writer.write_all(students, headers=headers, **options)
+
+    assert actual(values, run) == expected(values, run)
+
+
+def test_unselected_columns_are_not_evaluated():
+    calls = []
+
+    def evaluate(item):
+        calls.append(item)
+        return item
+
+    f = io.StringIO()
+    writer = list2csv.Writer(f)
+    writer.add_column('Unused', evaluate)
+    writer.add_column('V', lambda item: item * 10, aggregate_ids={'a'})
+    writer.add_aggregator('a', 'A', sum)
+    writer.write_all([1, 2], headers=['A'])
+    writer.write_row(3, ['A', 'A'])
+    assert calls == []
+    assert f.getvalue() == '10\r\n20\r\n30\r\n'
+
+
+def test_unknown_header(students):
+    def run(writer):
+        with pytest.raises(ValueError):
+            writer.write_all(students, headers=['Missing'])
+
+    actual(grades, run)
+
+
+def test_footers_of_no_rows():
+    f = io.StringIO()
+    writer = list2csv.Writer(f)
+    for accumulator in ('sum', 'fsum', 'count', 'mean', 'min', 'max', max):
+        writer.add_column(str(accumulator), lambda item: item)
+        writer.add_footer(str(accumulator), accumulator)
+    writer.write_footer()
+    assert f.getvalue() == ',,0,,,,\r\n'
+
+
+def test_footer_errors():
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_column('V', lambda item: item)
+    with pytest.raises(ValueError):
+        writer.add_footer('Missing')
+    with pytest.raises(ValueError):
+        writer.add_footer('V', 'median')
+    writer.add_footer('V')
+    with pytest.raises(ValueError):
+        writer.add_footer('V', 'max')
+    with pytest.raises(ValueError):
+        writer.write_all([1], workers=2)
@@ -0,0 +1,72 @@
+import bz2
+import gzip
+import io
+import lzma
+
+import pytest
+
+import list2csv
+from test_writer import WRITES, expected, grades, scenario
+
+READERS = {None: open, 'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+
+def read(path, compression, encoding='utf-8'):
+    with READERS[compression](str(path), 'rb') as f:
+        return f.read().decode(encoding)
+
+
+@pytest.mark.parametrize('compression', list(READERS))
+@pytest.mark.parametrize('buffer_size', [1, 100, 1 << 20])
+def test_matches_reference(tmp_path, students, compression, buffer_size):
+    path = tmp_path / 'out.csv'
+    run = scenario(students, WRITES['chunked'])
+    with list2csv.Writer.open(str(path), compression,
+                              buffer_size=buffer_size) as writer:
+        grades(writer, list2csv)
+        run(writer)
+    assert read(path, compression) == expected(grades, run)
+
+
+@pytest.mark.parametrize('compression, compresslevel',
+                         [('gzip', 1), ('bz2', 9), ('xz', 0)])
+def test_compresslevel(tmp_path, compression, compresslevel):
+    path = tmp_path / 'out.csv'
+    with list2csv.Writer.open(str(path), compression, compresslevel) \
+            as writer:
+        writer.add_column('V', lambda item: item)
+        writer.write_all(range(100))
+    assert read(path, compression) == ''.join(
+        '{}\r\n'.format(i) for i in range(100)
+    )
+
+
+@pytest.mark.parametrize('buffer_size', [1, 1 << 20])
+def test_encoding_and_close(tmp_path, buffer_size):
+    path = tmp_path / 'out.csv'
+    writer = list2csv.Writer.open(str(path), encoding='utf-16',
+                                  buffer_size=buffer_size)
+    writer.add_column('V', lambda item: item)
+    writer.write_all(['é', 'ü'])
+    writer.close()
+    writer.close()
+    assert read(path, None, 'utf-16') == 'é\r\nü\r\n'
+
+
+def test_close_has_no_effect_on_other_writers():
+    f = io.StringIO()
+    writer = list2csv.Writer(f)
+    writer.close()
+    writer.add_column('V', lambda item: item)
+    writer.write_row(1)
+    assert f.getvalue() == '1\r\n'
+
+
+def test_invalid_options(tmp_path):
+    path = str(tmp_path / 'out.csv')
+    with pytest.raises(ValueError):
+        list2csv.Writer.open(path, 'zip')
+    with pytest.raises(ValueError):
+        list2csv.Writer.open(path, compresslevel=6)
+    with pytest.raises(ValueError):
+        list2csv.Writer.open(path, buffer_size=0)
@@ -0,0 +1,50 @@
+import io
+
+import pytest
+
+import list2csv
+
+
+def test_aggregator_of_itself():
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_aggregator('a', 'A', sum, aggregate_ids={'a'})
+    with pytest.raises(ValueError, match="'A' -> 'A'"):
+        writer.compile()
+
+
+def test_aggregation_cycle():
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_column('V', lambda item: item, aggregate_ids={'a'})
+    writer.add_aggregator('a', 'A', sum, aggregate_ids={'b'})
+    writer.add_aggregator('b', 'B', sum, aggregate_ids={'a'})
+    with pytest.raises(ValueError, match='cycle'):
+        writer.write_row(1)
+
+
+def test_aggregator_without_columns():
+    f = io.StringIO()
+    writer = list2csv.Writer(f)
+    writer.add_aggregator('missing', 'A', sum)
+    with pytest.raises(ValueError, match="no columns with id 'missing'"):
+        writer.write_all([1])
+    writer.add_column('V', lambda item: item, aggregate_ids={'missing'})
+    writer.write_all([1, 2])
+    assert f.getvalue() == '1,1\r\n2,2\r\n'
+
+
+def test_each_column_is_evaluated_once_per_row():
+    calls = []
+
+    def evaluate(item):
+        calls.append(item)
+        return item
+
+    f = io.StringIO()
+    writer = list2csv.Writer(f)
+    writer.add_aggregator('a', 'A', sum)
+    writer.add_aggregator('b', 'B', max, aggregate_ids={'a'})
+    writer.add_column('V', evaluate, aggregate_ids={'a', 'b'})
+    writer.write_row(1)
+    writer.write_all([2, 3])
+    assert calls == [1, 2, 3]
+    assert f.getvalue() == '2,1,1\r\n4,2,2\r\n6,3,3\r\n'
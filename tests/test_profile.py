@@ -0,0 +1,50 @@
+import io
+import time
+
+import pytest
+
+import list2csv
+from test_writer import CONFIGURATIONS, WRITES, actual, expected, scenario
+
+
+@pytest.mark.parametrize('configure', CONFIGURATIONS)
+def test_profiled_matches_reference(students, configure):
+    run = scenario(students, WRITES['chunked'])
+    assert actual(configure, run, profile=True) == expected(configure, run)
+
+
+def test_profile_report():
+    def slow(item):
+        time.sleep(0.01)
+        return 'é' * item
+
+    writer = list2csv.Writer(io.StringIO(), profile=True)
+    writer.add_counter('N', aggregate_ids={'a'})
+    writer.add_column('Slow', slow, aggregate_ids={'a'})
+    writer.add_multi('M{}', lambda item: [item, item * 10], 2, '{:03}')
+    writer.add_aggregator('a', 'A', len)
+    writer.write_row(1)
+    writer.write_all([2, 3], chunk_size=1)
+    report = writer.profile_report()
+    assert [
+        (column.header, column.calls, column.output_bytes)
+        for column in report
+    ] == [
+        ('N', 3, 3),
+        ('Slow', 3, 12),
+        ('M{}', 3, 0),
+        ('M1', 3, 9),
+        ('M2', 3, 9),
+        ('A', 3, 3),
+    ]
+    times = {column.header: column for column in report}
+    assert times['Slow'].eval_time >= 0.03
+    assert times['A'].eval_time < 0.01
+    assert all(
+        column.eval_time >= 0 and column.format_time >= 0 for column in report
+    )
+
+
+def test_profile_report_needs_profile():
+    with pytest.raises(ValueError):
+        list2csv.Writer(io.StringIO()).profile_report()
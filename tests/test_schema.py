@@ -0,0 +1,121 @@
+import io
+import multiprocessing
+import pickle
+from statistics import mean
+
+import pytest
+
+import list2csv
+import reference
+from helpers import output
+
+
+def best_mark(student):
+    return max(student.assignment_marks)
+
+
+def first_mark(student):
+    return student.assignment_marks[0]
+
+
+def city(student):
+    return student.address.city.upper()
+
+
+@list2csv.register('tests.lab_total')
+def lab_total(student):
+    return sum(student.lab_marks)
+
+
+def configure(w, lib, registered=lab_total):
+    w.add_counter('N', 0)
+    w.add_column('ID', 'student_id', '{:>8}')
+    w.add_column('Best', best_mark, '{:.1f}', {'marks'})
+    w.add_column('Labs', registered, '{:.2f}')
+    w.add_column('City', city, cache_key='address.code', cache_size=2)
+    w.add_value('first', first_mark, {'marks'})
+    w.add_multi('A{}', 'assignment_marks', 3, '{:.2f}', {'marks'})
+    w.add_column('Scaled', lib.ref('first', func=abs))
+    w.add_wide_multi('L{}', 'lab_marks', 2)
+    w.add_aggregator('marks', 'Mean', mean, '{:.3f}')
+
+
+def schema():
+    result = list2csv.Schema()
+    configure(result, list2csv, list2csv.registered('tests.lab_total'))
+    return result
+
+
+def run(items, **options):
+    def write(writer):
+        writer.write_header()
+        writer.write_all(items, **options)
+
+    return write
+
+
+def expected(items):
+    return output(
+        reference.Writer, lambda w: configure(w, reference), run(items)
+    )
+
+
+def test_pickled_schema_matches_reference(students):
+    loaded = pickle.loads(pickle.dumps(schema()))
+    written = output(
+        list2csv.Writer, lambda w: None, run(students), schema=loaded
+    )
+    assert written == expected(students)
+
+
+def test_writers_share_a_schema(students):
+    shared = schema()
+    for chunk_size in (1, 7):
+        written = output(
+            list2csv.Writer, lambda w: None,
+            run(students, chunk_size=chunk_size), schema=shared
+        )
+        assert written == expected(students)
+
+
+def test_schema_columns_cannot_change_once_shared():
+    shared = schema()
+    list2csv.Writer(io.StringIO(), schema=shared)
+    with pytest.raises(ValueError):
+        shared.add_column('More', 'student_id')
+
+
+def test_fingerprint_survives_pickling():
+    fingerprint = schema().fingerprint()
+    assert pickle.loads(pickle.dumps(schema())).fingerprint() == fingerprint
+    changed = schema()
+    changed.add_column('Extra', 'grade')
+    assert changed.fingerprint() != fingerprint
+
+
+@pytest.mark.parametrize('evaluator', [
+    lambda s: s.grade, best_mark.__get__(0), str.upper.__get__('a'),
+    '{}'.format,
+])
+def test_fingerprint_rejects_unnamed_evaluators(evaluator):
+    unnamed = list2csv.Schema()
+    unnamed.add_column('X', evaluator)
+    with pytest.raises(ValueError):
+        unnamed.fingerprint()
+
+
+def test_spawned_workers_match_reference(students):
+    context = multiprocessing.get_context('spawn')
+    written = output(
+        list2csv.Writer, lambda w: None,
+        run(students, chunk_size=10, workers=2, mp_context=context),
+        schema=schema()
+    )
+    assert written == expected(students)
+
+
+def test_registry_errors():
+    with pytest.raises(ValueError):
+        list2csv.registered('tests.missing')
+    with pytest.raises(ValueError):
+        list2csv.register('tests.lab_total', best_mark)
@@ -0,0 +1,119 @@
+import io
+from typing import List, NamedTuple
+
+import pytest
+
+import list2csv
+import reference
+from helpers import Student, output
+
+
+class Mark(NamedTuple):
+    name: str
+    value: float
+    parts: List[int]
+    rank: int = 0
+
+    @property
+    def scaled(self):
+        return self.value * 10
+
+
+def test_dataclass_matches_reference(students):
+    def configure(w):
+        w.add_column('Student', 'student_id')
+        w.add_column('test_1_mark', 'test_1_mark', '{:.1f}')
+        w.add_column('test_2_mark', 'test_2_mark')
+        w.add_multi('assignment_marks {}', 'assignment_marks', 2)
+        w.add_multi('Lab {}', 'lab_marks', 4)
+        w.add_column('address', 'address')
+        w.add_column('grade', 'grade')
+
+    def run(writer):
+        writer.write_header()
+        writer.write_all(students)
+
+    f = io.StringIO()
+    writer = list2csv.Writer.from_type(
+        Student, f,
+        headers={'student_id': 'Student', 'lab_marks': 'Lab {}'},
+        formats={'test_1_mark': '{:.1f}'},
+        widths={'assignment_marks': 2, 'lab_marks': 4},
+        exclude=['comments'],
+    )
+    run(writer)
+    assert f.getvalue() == output(reference.Writer, configure, run)
+
+
+def test_named_tuple_matches_reference():
+    marks = [Mark('a', 1.5, [1, 2]), Mark('b', 2.25, [3, 4], 7)]
+
+    def configure(w):
+        w.add_column('name', 'name')
+        w.add_column('value', 'value', '{:.3f}')
+        w.add_column('rank', 'rank')
+        w.add_column('scaled', 'scaled')
+
+    def run(writer):
+        writer.write_header()
+        writer.write_all(marks)
+
+    f = io.StringIO()
+    writer = list2csv.Writer(f)
+    writer.add_type(Mark, formats={'value': '{:.3f}'}, exclude=['parts'])
+    run(writer)
+    assert f.getvalue() == output(reference.Writer, configure, run)
+
+
+def test_named_tuple_columns_match_rows():
+    marks = [Mark('a', 1.5, [1, 2]), Mark('b', 2.25, [3, 4], 7)]
+
+    def configure(writer):
+        writer.add_type(Mark, widths={'parts': 2}, properties=False)
+
+    rows = output(list2csv.Writer, configure,
+                  lambda writer: writer.write_all(marks))
+    columns = output(list2csv.Writer, configure, lambda writer: (
+        writer.write_columns({
+            name: [getattr(mark, name) for mark in marks]
+            for name in Mark._fields
+        })
+    ))
+    assert rows == columns == 'a,1.5,1,2,0\r\nb,2.25,3,4,7\r\n'
+
+
+def test_attrs_class_matches_reference():
+    attr = pytest.importorskip('attr')
+
+    @attr.s
+    class Point:
+        x = attr.ib()
+        y = attr.ib(default=0)
+        _hidden = attr.ib(default=None)
+
+    points = [Point(1, 2), Point(3)]
+
+    def configure(w):
+        w.add_column('x', 'x')
+        w.add_column('Y', 'y', '{:03}')
+
+    def run(writer):
+        writer.write_header()
+        writer.write_all(points)
+
+    f = io.StringIO()
+    writer = list2csv.Writer.from_type(
+        Point, f, headers={'y': 'Y'}, formats={'y': '{:03}'}
+    )
+    run(writer)
+    assert f.getvalue() == output(reference.Writer, configure, run)
+
+
+def test_type_errors():
+    writer = list2csv.Writer(io.StringIO())
+    with pytest.raises(ValueError, match="'missing'"):
+        writer.add_type(Mark, headers={'missing': 'M'})
+    with pytest.raises(ValueError, match="'parts'"):
+        writer.add_type(Mark)
+    with pytest.raises(TypeError):
+        writer.add_type(int)
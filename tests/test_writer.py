@@ -0,0 +1,407 @@
+import io
+import multiprocessing
+import threading
+import time
+from statistics import mean
+
+import pytest
+
+import list2csv
+import reference
+from helpers import Failing, output
+
+
+def grades(w, lib):
+    w.add_counter('Student Num')
+    w.add_column('ID', 'student_id')
+    w.add_column('Test 1', 'test_1_mark', '{:.2f}', {'test'})
+    w.add_column('Test 2', 'test_2_mark', '{:.2f}', {'test'})
+    w.add_aggregator('test', 'Av Test Mark', mean, '{:.2f}')
+    w.add_multi('Assignment {}', 'assignment_marks', 3, '{:.2f}', {'assignment'})
+    w.add_aggregator('assignment', 'Av Assignment Mark', mean, '{:.2f}')
+    w.add_wide_multi('Lab {}', 'lab_marks', 4, '{:.2f}', {'lab'})
+    w.add_aggregator('lab', 'Av. Lab Mark', mean, '{:.2f}')
+    w.add_column('Grade', 'grade', '{:.2f}')
+    w.add_column('City', 'address.city')
+    w.add_column('Comments', lambda s: '\n'.join(s.comments))
+
+
+def nested(w, lib):
+    w.add_aggregator('all', 'Total', sum, 'T={}', {'outer'})
+    w.add_counter('N', 10, -3, {'all'})
+    w.add_column('T1', lambda s: s.test_1_mark, '{0:>8}', {'all'})
+    w.add_multi('L{}', lambda s: iter(s.lab_marks), 2, '{!r}', {'all', 'x'})
+    w.add_aggregator('x', 'MaxL', max, '{:.1f}|{{}}', {'outer'})
+    w.add_aggregator('outer', 'Outer', list)
+    w.add_wide_multi('W{}', lambda s: s.lab_marks, 3, '{!s:>6}', {'x'})
+    w.add_column('Bool', lambda s: s.test_1_mark > 80, '{!s}')
+    w.add_counter('F', 0.5, 0.25)
+
+
+def values(w, lib):
+    w.add_value('mean', lambda s: mean(s.assignment_marks), {'m'})
+    w.add_value('best', lib.ref('mean', func=lambda m: m + 1))
+    w.add_column('Mean', lib.ref('mean'), '{:.3f}')
+    w.add_column('Both', lib.ref('mean', 'best'))
+    w.add_column('Diff', lib.ref('best', 'mean', func=lambda b, m: b - m))
+    w.add_column('Hidden', 'test_2_mark', aggregate_ids={'m'}, hidden=True)
+    w.add_multi('H{}', 'lab_marks', 2, aggregate_ids={'m'}, hidden=True)
+    w.add_wide_multi('W{}', 'lab_marks', 3, aggregate_ids={'m'}, hidden=True)
+    w.add_aggregator('m', 'Sum', sum, '{:.4f}')
+    w.add_column('Again', lambda s: mean(s.assignment_marks), '{:.1f}')
+
+
+def expressions(w, lib):
+    w.add_column('Weighted', lib.expr('test_1_mark * 0.6 + test_2_mark * 0.4'),
+                 '{:.2f}', {'e'})
+    w.add_column('Same', lib.expr('test_1_mark * 0.6 + test_2_mark * 0.4'))
+    w.add_column('First', lib.expr('assignment_marks[0]'), aggregate_ids={'e'})
+    w.add_column('Best', lib.expr('max(lab_marks) if test_1_mark > 60 else -1'))
+    w.add_column('Code', lib.expr('address.code * 2 + len(comments)'))
+    w.add_column('Label', lib.expr("student_id + ' / ' + str(len(lab_marks))"))
+    w.add_multi('S{}', lib.expr('lab_marks[1:]'), 2, '{:.1f}')
+    w.add_column('Lines', lib.expr(
+        '"""é\r\n""" + student_id + \\\r\n    str(test_1_mark)  # ü'
+    ))
+    w.add_column('Bracketed', lib.expr('''(
+        test_1_mark,  # a comment
+        """
+""" + str(comments[:1]),
+    )'''))
+    w.add_aggregator('e', 'E', sum)
+
+
+def features(w, lib):
+    w.add_counter('N')
+    w.add_column('Slow', lambda s: s.test_1_mark * 2, '{:.1f}', {'f'},
+                 concurrent=True)
+    w.add_column('Cached', lambda s: s.address.city.upper(),
+                 cache_key='address.code', cache_size=2)
+    w.add_batch_column('Batch', lambda items: [s.test_2_mark for s in items],
+                       4, '{:.2f}', {'f'})
+    w.add_column('Grade', 'grade', '{:.2f}', {'f'})
+    w.add_aggregator('f', 'Total', sum, '{:.2f}')
+
+
+CONFIGURATIONS = [grades, nested, values, expressions, features]
+
+
+def write_rows(writer, items):
+    for item in items:
+        writer.write_row(item)
+
+
+WRITES = {
+    'write_row': write_rows,
+    'write_all': lambda writer, items: writer.write_all(items),
+    'chunked': lambda writer, items: writer.write_all(items, chunk_size=7),
+    'iterator': lambda writer, items: writer.write_all(
+        iter(items), chunk_size=8
+    ),
+    'prefetch': lambda writer, items: writer.write_all(
+        items, chunk_size=5, prefetch=2
+    ),
+    'threads': lambda writer, items: writer.write_all(
+        items, chunk_size=6, threads=3
+    ),
+}
+# lambda evaluators can only be sent to forked worker processes
+if 'fork' in multiprocessing.get_all_start_methods():
+    WRITES['workers'] = lambda writer, items: writer.write_all(
+        items, chunk_size=4, workers=2,
+        mp_context=multiprocessing.get_context('fork')
+    )
+
+
+def expected(configure, write):
+    return output(reference.Writer, lambda w: configure(w, reference), write)
+
+
+def actual(configure, write, **options):
+    return output(
+        list2csv.Writer, lambda w: configure(w, list2csv), write, **options
+    )
+
+
+def scenario(items, write):
+    """
+    Writes the header, then the items with a single row either side of
+    ``write``, so row numbers carry across calls.
+    """
+    def run(writer):
+        writer.write_header()
+        writer.write_row(items[0])
+        write(writer, items[1:-1])
+        writer.write_row(items[-1])
+
+    return run
+
+
+@pytest.mark.parametrize('configure', CONFIGURATIONS)
+@pytest.mark.parametrize('write', WRITES.values(), ids=list(WRITES))
+def test_matches_reference(students, configure, write):
+    run = scenario(students, write)
+    assert actual(configure, run) == expected(configure, run)
+
+
+def test_columns_added_after_writing(students):
+    def configure(w, lib):
+        w.add_column('ID', 'student_id')
+
+    def run(writer):
+        writer.write_row(students[0])
+        writer.add_column('Grade', 'grade', '{:.1f}')
+        writer.write_all(students[1:])
+
+    assert actual(configure, run) == expected(configure, run)
+
+
+
+@pytest.mark.parametrize('configure', CONFIGURATIONS)
+@pytest.mark.parametrize('write', WRITES.values(), ids=list(WRITES))
+def test_failing_item(students, configure, write):
+    items = students[:11] + [Failing()] + students[11:]
+
+    def run(writer):
+        with pytest.raises(KeyError):
+            write(writer, items)
+        writer.write_all(students[:3])
+
+    assert actual(configure, run) == expected(configure, run)
+
+
+def test_chunk_size_must_be_positive(students):
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_column('ID', 'student_id')
+    with pytest.raises(ValueError):
+        writer.write_all(students, chunk_size=0)
+
+
+FORMATS = [
+    '{}', '{:.2f}', '{:>8}', '{0:>8}', '{!r}', '{!s:>6}', '{!a}', '{:,}',
+    '{:e}', 'T={}', '{:.1f}|{{}}', '{0}-{0}', '{:}', '{!r:}', '{:d}',
+]
+
+
+@pytest.mark.parametrize('data_format', FORMATS)
+@pytest.mark.parametrize('write', WRITES.values(), ids=list(WRITES))
+def test_formats(data_format, write):
+    items = [1, 2 ** 70, True, -7]
+
+    def configure(w, lib):
+        w.add_column('V', lambda item: item, data_format)
+        w.add_multi('M{}', lambda item: [item, item], 2, data_format)
+
+    def run(writer):
+        write(writer, items)
+        if data_format != '{:d}':
+            write(writer, [-2.5, 1234567.125, 0.1, float('nan')])
+
+    assert actual(configure, run) == expected(configure, run)
+
+
+def test_workers_must_be_positive(students):
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_column('ID', 'student_id')
+    with pytest.raises(ValueError):
+        writer.write_all(students, workers=0)
+
+
+
+def multis(w, lib):
+    w.add_multi('M{}', lambda item: item, 3, aggregate_ids={'a'})
+    w.add_wide_multi('W{}', lambda item: item, 3, aggregate_ids={'a'})
+    w.add_aggregator('a', 'A', sum)
+
+
+def test_wide_multi_of_too_many_values():
+    run = scenario([[1, 2, 3, 4], range(5), (6, 7, 8, 9), (10, 11, 12, 13)],
+                   WRITES['write_all'])
+    assert actual(multis, run) == expected(multis, run)
+
+
+def test_wide_multi_of_too_few_values():
+    with pytest.raises(IndexError):
+        actual(multis, lambda writer: writer.write_row([1, 2]))
+
+
+def test_batch_evaluator_called_per_batch(students):
+    calls = []
+
+    def lookup(items):
+        calls.append(len(items))
+        return [s.student_id for s in items]
+
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_batch_column('ID', lookup, 10)
+    writer.write_row(students[0])
+    writer.write_all(students[1:], chunk_size=20)
+    assert calls == [1, 10, 10, 10, 10, 4]
+
+
+def test_batch_size_must_be_positive():
+    with pytest.raises(ValueError):
+        list2csv.Writer(io.StringIO()).add_batch_column('V', list, 0)
+
+
+@pytest.mark.parametrize('cache_size, misses, evictions', [(4, 4, 0),
+                                                          (1, 45, 44)])
+def test_cache_report(students, cache_size, misses, evictions):
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_column('ID', 'student_id')
+    writer.add_column('City', lambda s: s.address.city,
+                      cache_key='address.code', cache_size=cache_size)
+    writer.write_all(students)
+    [stats] = writer.cache_report()
+    assert (stats.header, stats.misses, stats.hits, stats.evictions) == (
+        'City', misses, len(students) - misses, evictions
+    )
+
+
+def test_concurrent_columns_are_evaluated_at_once():
+    barrier = threading.Barrier(3, timeout=5)
+
+    def wait(item):
+        barrier.wait()
+        return item
+
+    f = io.StringIO()
+    writer = list2csv.Writer(f)
+    writer.add_column('V', wait, concurrent=True)
+    writer.add_column('W', lambda item: item * 2)
+    writer.write_all(range(6), chunk_size=3, threads=3)
+    assert f.getvalue() == ''.join(
+        '{},{}\r\n'.format(i, i * 2) for i in range(6)
+    )
+
+
+def test_prefetch_source_error():
+    def source():
+        yield from range(7)
+        raise RuntimeError('source')
+
+    f = io.StringIO()
+    writer = list2csv.Writer(f)
+    writer.add_column('V', lambda item: item)
+    with pytest.raises(RuntimeError, match='source'):
+        writer.write_all(source(), chunk_size=3, prefetch=1)
+    assert f.getvalue() == ''.join('{}\r\n'.format(i) for i in range(6))
+
+
+def test_prefetch_does_not_wait_for_a_slow_source():
+    release = threading.Event()
+    read = []
+
+    def source():
+        yield from range(3)
+        release.wait(10)
+        while True:
+            read.append(None)
+            yield 0
+
+    writer = list2csv.Writer(io.StringIO())
+    writer.add_column('V', lambda item: 1 / item)
+    start = time.perf_counter()
+    try:
+        with pytest.raises(ZeroDivisionError):
+            writer.write_all(source(), chunk_size=3, prefetch=1)
+        assert time.perf_counter() - start < 5
+    finally:
+        release.set()
+    time.sleep(0.2)
+    # the thread stops reading once it has read the item it was waiting for
+    assert len(read) <= 1
+
+
+def test_prefetch_must_not_be_negative():
+    with pytest.raises(ValueError):
+        list2csv.Writer(io.StringIO()).write_all([1], prefetch=-1)
+
+
+def test_values_are_evaluated_once_per_row():
+    calls = []
+
+    def evaluate(item):
+        calls.append(item)
+        return item * 10
+
+    f = io.StringIO()
+    writer = list2csv.Writer(f)
+    writer.add_value('v', evaluate, {'a'})
+    writer.add_column('V', list2csv.ref('v'))
+    writer.add_multi('M{}', list2csv.ref('v', func=lambda v: [v, v + 1]), 2)
+    writer.add_aggregator('a', 'A', sum)
+    writer.write_row(1)
+    writer.write_all([2, 3])
+    assert calls == [1, 2, 3]
+    assert f.getvalue() == ''.join(
+        '{0},{0},{1},{0}\r\n'.format(i * 10, i * 10 + 1) for i in (1, 2, 3)
+    )
+
+
+def test_value_errors():
+    writer = list2csv.Writer(io.StringIO())
+    with pytest.raises(ValueError):
+        list2csv.ref()
+    with pytest.raises(ValueError, match="No value named 'v'"):
+        writer.add_column('V', list2csv.ref('v'))
+    writer.add_value('v', lambda item: item)
+    with pytest.raises(ValueError, match="already exists"):
+        writer.add_value('v', lambda item: item)
+    with pytest.raises(ValueError):
+        writer.add_column('V', list2csv.ref('v'), concurrent=True)
+    with pytest.raises(ValueError):
+        writer.add_column('V', list2csv.ref('v'), cache_key='key')
+    with pytest.raises(ValueError, match="No column named 'v'"):
+        writer.add_footer('v')
+
+
+def test_hidden_columns_are_only_evaluated_when_aggregated():
+    calls = []
+
+    def evaluate(item):
+        calls.append(item)
+        return item
+
+    f = io.StringIO()
+    writer = list2csv.Writer(f)
+    writer.add_column('Unused', evaluate, hidden=True)
+    writer.add_column('Used', lambda item: item * 10, aggregate_ids={'a'},
+                      hidden=True)
+    writer.add_column('V', 'real')
+    writer.add_aggregator('a', 'A', sum)
+    writer.write_header()
+    writer.write_all([1, 2])
+    assert calls == []
+    assert f.getvalue() == 'V,A\r\n1,10\r\n2,20\r\n'
+    with pytest.raises(ValueError):
+        writer.add_footer('Unused')
+
+
+def test_strings_are_attribute_names():
+    class Item:
+        pass
+
+    item = Item()
+    setattr(item, 'a-b', 1)
+    setattr(item, 'None', 2)
+    item.a, item.b = 5, 3
+
+    def configure(w, lib):
+        w.add_column('Dash', 'a-b')
+        w.add_column('None', 'None')
+        w.add_column('Minus', lib.expr('a-b'))
+
+    def run(writer):
+        writer.write_all([item])
+
+    assert actual(configure, run) == expected(configure, run) == '1,2,2\r\n'
+
+
+@pytest.mark.parametrize('source', [
+    'a +', "__import__('os')", 'a.__class__', '[x for x in y]', 'lambda: 1',
+    'a\n+ b', '',
+])
+def test_invalid_expressions(source):
+    with pytest.raises(ValueError, match='expression'):
+        list2csv.expr(source)